@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Load and latency benchmark for the JSON-RPC API.
+
+Builds the app with create_app against a throwaway SQLite database and
+drives auth.login, account.create_account and account.get_logins_for_account
+through the real /api/v1 routes with a growing number of concurrent
+clients. For every scenario and concurrency it reports throughput,
+p50/p95/p99 latency, errors and SQL statements per request.
+
+With --serve the same scenarios run over HTTP against gunicorn started
+with the given worker profile (see gunicorn.conf.py), to compare the
+threaded and the gevent serving modes. SQL statements are not counted
+in that mode.
+
+Run from the repository root:
+    python -m benchmarks.bench_api --save benchmarks/baselines/$(git rev-parse --short HEAD).json
+    python -m benchmarks.bench_api --compare benchmarks/baselines/<commit>.json
+    python -m benchmarks.bench_api --serve threaded --save /tmp/threaded.json
+    python -m benchmarks.bench_api --serve gevent --compare /tmp/threaded.json
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+
+DATABASE_FILE = os.path.join(tempfile.gettempdir(), "flask-base-api-bench.db")
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{DATABASE_FILE}")
+os.environ.setdefault("APP_SETTINGS", "config.Benchmark")
+
+import bcrypt  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+import database  # noqa: E402
+from init_app import create_app  # noqa: E402
+from logger import CustomLogger  # noqa: E402
+from models.api import Account  # noqa: E402
+
+ACCOUNT_CODE = "BENCH"
+ADMIN_LOGIN_CODE = "bench-admin"
+ADMIN_SECRET = "bench-secret"
+SERVER_START_TIMEOUT = 30  # Seconds to wait for gunicorn to accept connections.
+
+
+class StatementCounter(object):
+    def __init__(self, engine):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        with self._lock:
+            self.count += 1
+
+
+class Client(object):
+    """One JSON-RPC client per thread, Flask test clients are not shared."""
+
+    _local = threading.local()
+
+    def __init__(self, app):
+        self.app = app
+
+    def request(self, blueprint: str, method: str, **params) -> tuple:
+        """:return: (HTTP status, JSON body)"""
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+
+        response = client.post(
+            f"/api/v1/{blueprint}",
+            json={"jsonrpc": "2.0", "method": method, "params": params, "id": 1},
+        )
+        return response.status_code, response.get_json()
+
+    def call(self, blueprint: str, method: str, **params) -> bool:
+        status, body = self.request(blueprint, method, **params)
+        return status == 200 and body.get("result", {}).get("code") == "ok"
+
+
+class HTTPClient(Client):
+    """One keep-alive HTTP connection per thread to a running server."""
+
+    _local = threading.local()
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+
+    def request(self, blueprint: str, method: str, **params) -> tuple:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+
+        body = json.dumps({"jsonrpc": "2.0", "method": method, "params": params, "id": 1})
+        try:
+            connection.request("POST", f"/api/v1/{blueprint}", body, {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            return response.status, json.loads(response.read() or b"{}")
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self._local.connection = None
+            return 0, {}
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def setup_database(rounds: int):
+    if os.path.exists(DATABASE_FILE):
+        os.remove(DATABASE_FILE)
+
+    with database.db_session_manager() as s:
+        engine = s.get_bind(Account)
+    database.APIBase.metadata.create_all(engine)
+
+    with database.db_session_manager() as s:
+        admin = Account()
+        admin.code = ACCOUNT_CODE
+        admin.login_code = ADMIN_LOGIN_CODE
+        admin.login_secret = bcrypt.hashpw(ADMIN_SECRET.encode(), bcrypt.gensalt(rounds))
+        admin.admin_level = 5
+        s.add(admin)
+        s.commit()
+
+    return engine
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(profile: str, port: int) -> subprocess.Popen:
+    """Start gunicorn on the benchmark database and wait until it accepts connections."""
+    env = dict(
+        os.environ,
+        GUNICORN_WORKER_PROFILE=profile,
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        LOGFILE=os.path.join(tempfile.gettempdir(), "flask-base-api-bench.log"),
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app:app"],
+        cwd=root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {server.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+
+    server.terminate()
+    raise RuntimeError(f"gunicorn did not start within {SERVER_START_TIMEOUT}s")
+
+
+def run_scenario(name: str, call, concurrency: int, requests: int, counter: StatementCounter = None) -> dict:
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker(_):
+        nonlocal errors
+        started = time.perf_counter()
+        ok = call()
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    statements_before = counter.count if counter else 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(requests)))
+    elapsed = time.perf_counter() - started
+    statements = counter.count - statements_before if counter else None
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "throughput": requests / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "statements_per_request": statements / requests if requests and statements is not None else None,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(results: list, baseline_file: str, threshold: float) -> bool:
+    """
+    Print the change against a saved baseline.
+
+    :return: False if a scenario regressed by more than `threshold` percent
+    """
+    with open(baseline_file) as f:
+        baseline = {(r["scenario"], r["concurrency"]): r for r in json.load(f)["results"]}
+
+    ok = True
+    print(f"\nCompared to {baseline_file}:")
+    for result in results:
+        before = baseline.get((result["scenario"], result["concurrency"]))
+        if before is None:
+            continue
+
+        throughput = (result["throughput"] / before["throughput"] - 1) * 100 if before["throughput"] else 0.0
+        p95 = (result["p95_ms"] / before["p95_ms"] - 1) * 100 if before["p95_ms"] else 0.0
+        if result["statements_per_request"] is None or before["statements_per_request"] is None:
+            statements = 0.0
+        else:
+            statements = result["statements_per_request"] - before["statements_per_request"]
+        regressed = throughput < -threshold or p95 > threshold or statements > 0
+        ok = ok and not regressed
+
+        print(
+            f"{result['scenario']:<24} c={result['concurrency']:<3} "
+            f"throughput {throughput:+7.1f}%  p95 {p95:+7.1f}%  statements/req {statements:+.2f}"
+            + ("  REGRESSION" if regressed else "")
+        )
+
+    return ok
+
+
+def run_scenarios(args, client: Client, counter: StatementCounter = None) -> list:
+    status, login_response = client.request(
+        "auth", "login", ac=ACCOUNT_CODE, lc=ADMIN_LOGIN_CODE, ls=ADMIN_SECRET
+    )
+    key = login_response["result"]["api_key"]
+    new_login_codes = count()
+
+    scenarios = {
+        "auth.login": lambda: client.call(
+            "auth", "login", ac=ACCOUNT_CODE, lc=ADMIN_LOGIN_CODE, ls=ADMIN_SECRET
+        ),
+        "account.create_account": lambda: client.call(
+            "account", "create_account", account_code=ACCOUNT_CODE, key=key,
+            login_code=f"bench-user-{next(new_login_codes)}", login_secret_1="secret", login_secret_2="secret",
+        ),
+        "account.get_logins_for_account": lambda: client.call(
+            "account", "get_logins_for_account", account_code=ACCOUNT_CODE, key=key, lc=ADMIN_LOGIN_CODE
+        ),
+    }
+
+    results = []
+    print(
+        f"{'scenario':<32} {'conc':>4} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+        f"{'errors':>7} {'sql/req':>8}"
+    )
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        for name, call in scenarios.items():
+            result = run_scenario(name, call, concurrency, args.requests, counter)
+            results.append(result)
+            statements = result["statements_per_request"]
+            print(
+                f"{name:<32} {concurrency:>4} {result['throughput']:>9.1f} {result['p50_ms']:>9.2f} "
+                f"{result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['errors']:>7} "
+                + (f"{statements:>8.2f}" if statements is not None else f"{'-':>8}")
+            )
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma separated client counts.")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario and concurrency.")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4, help="Cost factor of the seeded admin password.")
+    parser.add_argument("--save", help="Write the results as JSON to this file.")
+    parser.add_argument("--compare", help="Compare against a JSON file written with --save.")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Allowed regression in percent.")
+    parser.add_argument(
+        "--admission", action="store_true", help="Keep admission control on, the scenarios then hit its rate limits."
+    )
+    parser.add_argument(
+        "--serve", choices=("sync", "threaded", "gevent"), help="Benchmark gunicorn with this worker profile over HTTP."
+    )
+    args = parser.parse_args()
+
+    if args.admission:
+        os.environ["APP_SETTINGS"] = "config.Config"
+
+    log = CustomLogger()
+    log.log_to_screen = False
+    log.log_to_file = False
+    log.log_to_database = False
+
+    server = None
+    if args.serve:
+        database.configure_engine(url=os.environ["DATABASE_URL"])
+        engine = setup_database(args.bcrypt_rounds)
+        database.dispose_engine()
+        counter = None
+        port = free_port()
+        server = start_server(args.serve, port)
+        client = HTTPClient("127.0.0.1", port)
+    else:
+        app = create_app()
+        # Failed calls are counted as errors, the tracebacks would only drown the table.
+        app.logger.disabled = True
+        engine = setup_database(args.bcrypt_rounds)
+        counter = StatementCounter(engine)
+        client = Client(app)
+
+    try:
+        results = run_scenarios(args, client, counter)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w") as f:
+            json.dump(
+                {
+                    "commit": git_commit(),
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "python": platform.python_version(),
+                    "database": engine.dialect.name,
+                    "arguments": vars(args),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+        print(f"\nSaved results to {args.save}")
+
+    if args.compare and not compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the cost of a CustomLogger call on the calling thread.
+
+Run from the repository root:
+    python -m benchmarks.bench_logger
+"""
+import datetime
+import inspect
+import itertools
+import timeit
+
+from flask import Flask
+
+from logger import CustomLogger, LogLimiter
+
+NUMBER = 100000
+
+
+class NullWriter(object):
+    """Accepts records without writing them, so only the caller's cost is measured."""
+
+    def submit(self, record):
+        pass
+
+    def close(self):
+        pass
+
+
+def legacy_call(log: CustomLogger, message: str):
+    """The per-call work the logger did before records were deferred."""
+    message = str(message)
+    timestamp = datetime.datetime.now()
+    stack_info = inspect.stack()[1][3]
+    return f"[{str(timestamp)}] [- not logged in -] [{stack_info}] {message}"
+
+
+def measure(statement, number: int = NUMBER) -> float:
+    """:return: nanoseconds per call"""
+    return min(timeit.repeat(statement, number=number, repeat=3)) / number * 1e9
+
+
+def main():
+    log = CustomLogger()
+    log.writer = NullWriter()
+    log.log_to_screen = True
+    log.log_to_file = False
+    log.log_to_database = False
+    # The limiter as configured by default, see LOG_DEDUPLICATE_WINDOW and LOG_RATE_LIMIT.
+    log.limiter = LogLimiter()
+    response = {"code": "ok", "message": "logged in", "api_key": "0" * 64}
+
+    with Flask(__name__).app_context():
+        log.log_level = "WARNING"
+        disabled = measure(lambda: log.debug("benchmark message"))
+
+        log.log_level = "DEBUG"
+        enabled = measure(lambda: log.debug("benchmark message"))
+        enabled_dict = measure(lambda: log.debug(response))
+
+        log.log_to_screen = False
+        log.log_to_file = True
+        enabled_file_only = measure(lambda: log.debug("benchmark message"))
+
+        log.limiter = LogLimiter(deduplicate_window=5, rate_limit=100)
+        limiter_on = measure(lambda: log.debug("benchmark message"))
+        limiter_on_dict = measure(lambda: log.debug(response))
+
+        log.limiter = LogLimiter(deduplicate_window=60, rate_limit=0)
+        deduplicated = measure(lambda: log.debug("benchmark message"))
+
+        counter = itertools.count()
+        log.limiter = LogLimiter(deduplicate_window=0, rate_limit=1)
+        rate_limited = measure(lambda: log.debug(f"benchmark message {next(counter)}"))
+
+        log.limiter = LogLimiter(sample_rates={"DEBUG": 0.01}, deduplicate_window=0, rate_limit=0)
+        sampled = measure(lambda: log.debug("benchmark message"))
+
+        legacy = measure(lambda: legacy_call(log, "benchmark message"), number=NUMBER // 100)
+
+    print("default configuration, limiter off:")
+    print(f"disabled level:             {disabled:10.0f} ns/call")
+    print(f"enabled level, screen sink: {enabled:10.0f} ns/call")
+    print(f"  dict message:             {enabled_dict:10.0f} ns/call")
+    print(f"enabled level, file sink:   {enabled_file_only:10.0f} ns/call")
+    print("limiter on, file sink:")
+    print(f"5s dedup, 100/s limit:      {limiter_on:10.0f} ns/call")
+    print(f"  dict message:             {limiter_on_dict:10.0f} ns/call")
+    print(f"repeated, deduplicated:     {deduplicated:10.0f} ns/call")
+    print(f"distinct, rate limited:     {rate_limited:10.0f} ns/call")
+    print(f"sampled at 1%:              {sampled:10.0f} ns/call")
+    print(f"legacy inspect.stack():     {legacy:10.0f} ns/call")
+
+
+if __name__ == "__main__":
+    main()
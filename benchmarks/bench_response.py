@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of helpers.response.Response against the class it
+replaced, for construction, to_json and JSON encoding.
+
+Run from the repository root:
+    python -m benchmarks.bench_response
+"""
+import json
+import sys
+import timeit
+
+from flask.json import JSONEncoder
+
+from helpers.response import Response, json_encoder, orjson
+
+NUMBER = 200000
+
+
+class LegacyResponse:
+    """The Response class before it used __slots__."""
+
+    optional_fields = {}
+
+    def __init__(self, code: str, message: str, **kwargs):
+
+        valid_codes = ["ok", "error"]
+
+        if code not in valid_codes:
+            raise ValueError(f"Error code should be one of: {', '.join(valid_codes)}")
+
+        self.code = code
+        self.message = message
+
+        if len(list({**kwargs})) > 0:
+            self.optional_fields = {**kwargs}
+
+    def to_json(self):
+
+        mandatory_fields = {
+            "code": self.code,
+            "message": self.message
+        }
+
+        if len(list({**self.optional_fields})) > 0:
+            return {**mandatory_fields, **self.optional_fields}
+        else:
+            return mandatory_fields
+
+
+def measure(statement, number: int = NUMBER) -> float:
+    """:return: nanoseconds per call"""
+    return min(timeit.repeat(statement, number=number, repeat=3)) / number * 1e9
+
+
+def main():
+    fields = {"api_key": "a" * 64, "login_code": "jantje@gmail.com", "admin_level": 3}
+    rows = []
+
+    for name, cls in (("legacy", LegacyResponse), ("slots", Response)):
+        plain = cls("ok", "logged in", **fields)
+        rows.append((f"{name} construct", measure(lambda: cls("ok", "logged in", **fields))))
+        rows.append((f"{name} construct, no fields", measure(lambda: cls("error", "invalid credentials"))))
+        rows.append((f"{name} to_json", measure(plain.to_json)))
+        rows.append((f"{name} construct + to_json", measure(lambda: cls("ok", "logged in", **fields).to_json())))
+
+    payload = {"id": 1, "jsonrpc": "2.0", "result": Response("ok", "logged in", **fields).to_json()}
+    rows.append(("json encode", measure(lambda: json.dumps(payload, cls=JSONEncoder, sort_keys=True))))
+    if orjson is not None:
+        encoder = json_encoder(fast=True)
+        rows.append(("orjson encode", measure(lambda: json.dumps(payload, cls=encoder, sort_keys=True))))
+    else:
+        print("orjson is not installed, skipping the fast encoder", file=sys.stderr)
+
+    print(f"{'case':<34}{'ns/call':>10}")
+    for case, ns in rows:
+        print(f"{case:<34}{ns:>10.0f}")
+    print(f"{'slots bytes/instance':<34}{sys.getsizeof(Response('ok', 'x')):>10}")
+    print(f"{'legacy bytes/instance':<34}{sys.getsizeof(LegacyResponse('ok', 'x')) + sys.getsizeof(LegacyResponse('ok', 'x').__dict__):>10}")
+
+
+if __name__ == "__main__":
+    main()
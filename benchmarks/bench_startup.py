@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Import and startup time check for the app factory.
+
+Imports init_app and calls create_app in fresh interpreters with the
+in-memory config.Testing settings and no DATABASE_URL. It reports the
+median import and startup time, and fails if either exceeds its budget or
+if create_app opened a database engine.
+
+Run from the repository root:
+    python -m benchmarks.bench_startup --runs 5 --import-budget-ms 400 --startup-budget-ms 600
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+CHILD = """
+import json
+import time
+
+started = time.perf_counter()
+import init_app
+imported = time.perf_counter()
+app = init_app.create_app()
+created = time.perf_counter()
+
+import database
+
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "startup_ms": (created - imported) * 1000,
+    "engine_created": database._engine is not None,
+}))
+"""
+
+
+def measure() -> dict:
+    env = dict(os.environ, APP_SETTINGS="config.Testing")
+    env.pop("DATABASE_URL", None)
+    output = subprocess.check_output([sys.executable, "-c", CHILD], env=env, text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to start.")
+    parser.add_argument("--import-budget-ms", type=float, default=400.0, help="Maximum median import time.")
+    parser.add_argument("--startup-budget-ms", type=float, default=600.0, help="Maximum median create_app time.")
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    import_ms = statistics.median(r["import_ms"] for r in runs)
+    startup_ms = statistics.median(r["startup_ms"] for r in runs)
+    engine_created = any(r["engine_created"] for r in runs)
+
+    print(f"import init_app: {import_ms:8.1f} ms (budget {args.import_budget_ms:.0f} ms)")
+    print(f"create_app():    {startup_ms:8.1f} ms (budget {args.startup_budget_ms:.0f} ms)")
+    print(f"engine created:  {engine_created}")
+
+    if import_ms > args.import_budget_ms or startup_ms > args.startup_budget_ms or engine_created:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,77 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     DEVELOPMENT = True
+    DATABASE_POOL_SIZE = 15
+    DATABASE_MAX_OVERFLOW = 5
+    DATABASE_POOL_RECYCLE = 1800
+    DATABASE_POOL_PRE_PING = True
+    DATABASE_POOL_TIMEOUT = 30
+    DATABASE_POOL_WARMUP = 0
+    DATABASE_REPLICA_URLS = [url for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url]
+    DATABASE_REPLICA_BALANCING = "round_robin"
+    DATABASE_REQUEST_SESSION = True
+    DATABASE_CREATE_ALL = False
+    MIGRATIONS_ENABLED = True
+    TOKEN_CACHE_SIZE = 10000
+    TOKEN_CACHE_TTL = 30
+    ACCOUNT_CACHE_SIZE = 10000
+    ACCOUNT_CACHE_TTL = 60
+    ACCOUNT_CACHE_NEGATIVE_SIZE = 10000
+    ACCOUNT_CACHE_NEGATIVE_TTL = 5
+    PASSWORD_HASH_WORKERS = 2
+    PASSWORD_HASH_QUEUE_SIZE = 32
+    PASSWORD_HASH_QUEUE_TIMEOUT = 5
+    PASSWORD_HASH_BULK_JOBS = 1
+    TOKEN_REAPER_INTERVAL = 300
+    TOKEN_REAPER_BATCH_SIZE = 1000
+    TOKEN_SLIDING_EXPIRATION = False
+    TOKEN_EXTEND_THRESHOLD = 3600
+    TOKEN_EXTEND_BUFFERED = False
+    TOKEN_EXTEND_FLUSH_INTERVAL = 5
+    TOKEN_SIGNED = False
+    TOKEN_SIGNING_KEYS = [key for key in os.environ.get("TOKEN_SIGNING_KEYS", "").split(",") if key]
+    TOKEN_DENYLIST_REFRESH_INTERVAL = 10
+    JSONRPC_BATCH_CONCURRENCY = 1
+    ADMISSION_ENABLED = True
+    ADMISSION_CONCURRENCY = {
+        "auth.login": 8,
+        "account.create_account": 4,
+        "account.create_accounts": 1,
+    }
+    ADMISSION_RATE_LIMITED_METHODS = ["auth.login"]
+    ADMISSION_ACCOUNT_RATE = 20.0
+    ADMISSION_ACCOUNT_BURST = 40
+    ADMISSION_LOGIN_RATE = 0.2
+    ADMISSION_LOGIN_BURST = 5
+    ADMISSION_MAX_BUCKETS = 100000
+    JSON_FAST_ENCODER = True
+    LOG_QUEUE_SIZE = 10000
+    LOG_QUEUE_POLICY = "drop"
+    LOG_FLUSH_INTERVAL = 1.0
+    LOG_FLUSH_SIZE = 64 * 1024
+    LOG_DB_BATCH_SIZE = 500
+    LOG_SAMPLE_RATES = {}
+    LOG_DEDUPLICATE_WINDOW = 0
+    LOG_RATE_LIMIT = 0
+    METRICS_ENABLED = True
+    METRICS_DIR = os.environ.get("METRICS_DIR")
+    METRICS_FLUSH_INTERVAL = 5
 
 
 class Development(Config):
     LOGLEVEL = "DEBUG"
+
+
+class Benchmark(Config):
+    ADMISSION_ENABLED = False
+
+
+class Testing(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    DATABASE_CREATE_ALL = True
+    MIGRATIONS_ENABLED = False
+    PASSWORD_HASH_WORKERS = 0
+    TOKEN_REAPER_INTERVAL = 0
+    ADMISSION_ENABLED = False
+    METRICS_DIR = None
@@ -1,11 +1,16 @@
+import itertools
 import os
+import threading
 from contextlib import contextmanager
 
-from sqlalchemy import create_engine
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from helpers.metrics import TimedQueuePool
 
-if os.environ["DATABASE_URL"] is None:
-    pass
 APIBase = declarative_base()
 
 SessionMaker = sessionmaker(
@@ -13,16 +18,403 @@ SessionMaker = sessionmaker(
     autoflush=True
 )
 
-SessionMaker.configure(
-    binds={
-        APIBase: create_engine(url=os.environ["DATABASE_URL"], pool_size=15, max_overflow=5)
+DATABASE_POOL_SIZE = 15  # Connections kept open per worker.
+DATABASE_MAX_OVERFLOW = 5  # Extra connections opened under load, closed when returned.
+DATABASE_POOL_RECYCLE = 1800  # Seconds after which a connection is replaced, -1 never replaces.
+DATABASE_POOL_PRE_PING = True  # Test connections on checkout so a dropped connection is not handed out.
+DATABASE_POOL_TIMEOUT = 30  # Seconds to wait for a free connection before raising.
+DATABASE_REPLICA_BALANCING = "round_robin"  # How read-only sessions pick a replica: round_robin or least_connections.
+DATABASE_REQUEST_SESSION = True  # Share one session between the db_session_manager() blocks of a request.
+
+_engine = None
+_engine_lock = threading.Lock()
+_engine_settings = {
+    "url": None,
+    "pool_size": DATABASE_POOL_SIZE,
+    "max_overflow": DATABASE_MAX_OVERFLOW,
+    "pool_recycle": DATABASE_POOL_RECYCLE,
+    "pool_pre_ping": DATABASE_POOL_PRE_PING,
+    "pool_timeout": DATABASE_POOL_TIMEOUT,
+    "replica_urls": (),
+    "replica_balancing": DATABASE_REPLICA_BALANCING,
+}
+_engine_callbacks = []
+_replicas = None
+
+
+def engine_options(url: str) -> dict:
+    # An in-memory database only exists on its one connection, share it between threads.
+    if url in ("sqlite://", "sqlite:///:memory:"):
+        return {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+    # SQLite does not use a QueuePool and rejects pool sizing arguments.
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": _engine_settings["pool_size"],
+        "max_overflow": _engine_settings["max_overflow"],
+        "pool_recycle": _engine_settings["pool_recycle"],
+        "pool_pre_ping": _engine_settings["pool_pre_ping"],
+        "pool_timeout": _engine_settings["pool_timeout"],
     }
-)
+
+
+def configure_engine(**settings):
+    """
+    Set the url and pool options used when the engine is created.
+    None values are ignored. Has no effect on an engine that already
+    exists, call dispose_engine() first to recreate it.
+
+    :param settings: url, pool_size, max_overflow, pool_recycle, pool_pre_ping, pool_timeout,
+        replica_urls, replica_balancing
+    """
+    for name, value in settings.items():
+        if name not in _engine_settings:
+            raise ValueError(f"Unknown engine setting '{name}'")
+        if value is not None:
+            _engine_settings[name] = value
+
+
+def on_engine_created(callback):
+    """
+    Call `callback(engine)` when the engine is created, or right away
+    if it already exists.
+    """
+    with _engine_lock:
+        if callback not in _engine_callbacks:
+            _engine_callbacks.append(callback)
+        if _engine is not None:
+            callback(_engine)
+
+
+def get_engine():
+    """
+    :return: the engine shared by db_session_manager and Flask-SQLAlchemy,
+        created on first use
+    """
+    global _engine
+
+    if _engine is not None:
+        return _engine
+
+    with _engine_lock:
+        if _engine is None:
+            url = _engine_settings["url"] or os.environ.get("DATABASE_URL")
+            if not url:
+                raise RuntimeError("No database configured, set DATABASE_URL or SQLALCHEMY_DATABASE_URI")
+            engine = create_engine(url=url, **engine_options(url))
+            SessionMaker.configure(
+                binds={
+                    APIBase: engine
+                }
+            )
+            event.listen(engine, "before_cursor_execute", _track_write)
+            for callback in _engine_callbacks:
+                callback(engine)
+            _engine = engine
+
+    return _engine
+
+
+class ReplicaSet(object):
+    """
+    Read replicas of the primary database. pick() returns the engine for
+    the next read-only session: in turn with "round_robin", or the one
+    with the fewest open read-only sessions in this process with
+    "least_connections". Call release() when that session is closed.
+    """
+
+    def __init__(self, engines: list, balancing: str = DATABASE_REPLICA_BALANCING):
+        if balancing not in ("round_robin", "least_connections"):
+            raise ValueError(f"Unknown replica balancing '{balancing}', use round_robin or least_connections")
+        self.engines = engines
+        self.balancing = balancing
+        self._turn = itertools.count()
+        self._in_use = {engine: 0 for engine in engines}
+        self._lock = threading.Lock()
+
+    def pick(self):
+        with self._lock:
+            if self.balancing == "least_connections":
+                engine = min(self.engines, key=self._in_use.__getitem__)
+            else:
+                engine = self.engines[next(self._turn) % len(self.engines)]
+            self._in_use[engine] += 1
+            return engine
+
+    def release(self, engine):
+        with self._lock:
+            self._in_use[engine] -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {str(engine.url): in_use for engine, in_use in self._in_use.items()}
+
+
+def get_replicas() -> ReplicaSet:
+    """
+    :return: the ReplicaSet of the configured replica_urls, created on
+        first use, or None if no replicas are configured
+    """
+    global _replicas
+
+    if _replicas is not None or not _engine_settings["replica_urls"]:
+        return _replicas
+
+    get_engine()
+    with _engine_lock:
+        if _replicas is None:
+            engines = []
+            for url in _engine_settings["replica_urls"]:
+                engine = create_engine(url=url, **engine_options(url))
+                for callback in _engine_callbacks:
+                    callback(engine)
+                engines.append(engine)
+            _replicas = ReplicaSet(engines, _engine_settings["replica_balancing"])
+
+    return _replicas
+
+
+def _track_write(conn, cursor, statement, parameters, context, executemany):
+    # Reads after a write in the same request go to the primary, the replicas may lag behind.
+    if (context.isinsert or context.isupdate or context.isdelete) and has_app_context():
+        g.db_wrote = True
+
+
+def wrote_in_request() -> bool:
+    """
+    :return: True if a statement in the current request changed the
+        primary database
+    """
+    return has_app_context() and g.get("db_wrote", False)
+
+
+def create_all(engine):
+    """
+    Create all tables on `engine`, used for throwaway databases such as the
+    in-memory SQLite database of config.Testing.
+    """
+    import models.api  # noqa: F401
+    import models.log  # noqa: F401
+
+    APIBase.metadata.create_all(engine)
+
+
+def dispose_engine():
+    """
+    Close all pooled connections. The engine keeps working and opens new
+    connections on demand.
+    """
+    if _engine is not None:
+        _engine.dispose()
+    if _replicas is not None:
+        for engine in _replicas.engines:
+            engine.dispose()
+
+
+def warm_up_pool(count: int):
+    """
+    Open `count` connections at once and return them to the pool, so the
+    first requests do not pay for connecting.
+    """
+    engine = get_engine()
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(engine.connect())
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+class SharedEngineSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy extension that uses the engine of db_session_manager
+    instead of building a second pool against the same database.
+    """
+
+    def create_engine(self, sa_url, engine_opts):
+        return get_engine()
+
+
+class SessionScope(object):
+    """
+    One unit of work shared by every db_session_manager() block run while
+    the scope is active. The blocks reuse one session, so one connection
+    and one identity map, and what they leave uncommitted is committed or
+    rolled back once by close(). Sessions are opened, and connections
+    checked out, on first use only.
+
+    Read-only blocks share one replica session, picked once for the
+    scope, until the request writes to the primary.
+    """
+
+    def __init__(self):
+        self._session = None
+        self._replica_session = None
+        self._replica = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            get_engine()
+            # Objects loaded earlier in the scope stay usable after a block commits.
+            self._session = SessionMaker(expire_on_commit=False)
+        return self._session
+
+    def read_session(self, replicas: ReplicaSet):
+        if self._replica_session is None:
+            self._replica = replicas.pick()
+            self._replica_session = SessionMaker(
+                binds={APIBase: self._replica}, expire_on_commit=False, info={"replica": True}
+            )
+        return self._replica_session
+
+    @staticmethod
+    def end_block(s):
+        """
+        A block that caught a failed commit leaves the transaction
+        unusable, roll it back so the next block can use the session.
+        """
+        transaction = s.get_transaction()
+        if transaction is not None and not transaction.is_active:
+            s.rollback()
+
+    def release_connection(self):
+        """
+        Commit what was done so far, which returns the connections to
+        the pool. Loaded objects stay loaded, the next block checks a
+        connection out again.
+        """
+        for s in (self._session, self._replica_session):
+            if s is not None and s.in_transaction():
+                s.commit()
+
+    def close(self, commit: bool = False):
+        """
+        Commit, or roll back, what the blocks left uncommitted and give
+        the connections back to the pool.
+        """
+        try:
+            if commit and self._session is not None and self._session.in_transaction():
+                self._session.commit()
+        finally:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+            if self._replica_session is not None:
+                self._replica_session.close()
+                self._replica_session = None
+                get_replicas().release(self._replica)
+
+
+def current_session_scope():
+    if not has_app_context():
+        return None
+    return g.get("db_session_scope")
 
 
 @contextmanager
-def db_session_manager():
-    db_session = SessionMaker()
+def shared_session():
+    """
+    Let every db_session_manager() block inside this context share one
+    session. Inside a request with a request session that is the
+    request's own scope already, which is used as it is.
+    """
+    scope = current_session_scope()
+    if scope is not None:
+        yield scope
+        return
+
+    scope = g.db_session_scope = SessionScope()
+    committed = False
+    try:
+        yield scope
+        committed = True
+    finally:
+        g.db_session_scope = None
+        scope.close(commit=committed)
+
+
+def init_request_sessions(app):
+    """
+    Give every request of `app` a SessionScope, so all helpers that run
+    for one request share a session. It is committed once after the
+    view returned a response below 400, and rolled back otherwise. A
+    failed commit turns the response into a 500.
+    """
+
+    @app.before_request
+    def open_request_session():
+        g.db_session_scope = SessionScope()
+
+    @app.after_request
+    def commit_request_session(response):
+        scope = g.pop("db_session_scope", None)
+        if scope is not None:
+            scope.close(commit=response.status_code < 400)
+        return response
+
+    @app.teardown_request
+    def close_request_session(exc):
+        scope = g.pop("db_session_scope", None)
+        if scope is not None:
+            scope.close(commit=False)
+
+
+def release_connection():
+    """
+    Call before slow work that needs no database, such as hashing a
+    password, so the request does not hold a pooled connection through
+    it. Commits what the request did so far. Does nothing outside a
+    request session, a plain db_session_manager() block returns its
+    connection when it ends.
+    """
+    scope = current_session_scope()
+    if scope is not None:
+        scope.release_connection()
+
+
+@contextmanager
+def db_session_manager(read_only: bool = False):
+    """
+    Open a session for one block of work, or join the session of the
+    current request or shared_session().
+
+    :param read_only: the block only reads, it may run on a read replica.
+        It runs on the primary anyway if no replicas are configured or if
+        the current request already wrote to the primary.
+    """
+    replicas = get_replicas() if read_only else None
+    if replicas is not None and wrote_in_request():
+        replicas = None
+
+    scope = current_session_scope()
+    if scope is not None:
+        db_session = scope.session if replicas is None else scope.read_session(replicas)
+        try:
+            yield db_session
+        except Exception as e:
+            db_session.rollback()
+            raise e
+        finally:
+            scope.end_block(db_session)
+        return
+
+    if replicas is None:
+        get_engine()
+        db_session = SessionMaker()
+        try:
+            yield db_session
+        except Exception as e:
+            db_session.rollback()
+            raise e
+        finally:
+            db_session.close()
+        return
+
+    replica = replicas.pick()
+    db_session = SessionMaker(binds={APIBase: replica}, info={"replica": True})
     try:
         yield db_session
     except Exception as e:
@@ -30,3 +422,25 @@ def db_session_manager():
         raise e
     finally:
         db_session.close()
+        replicas.release(replica)
+
+
+def read_with_primary_fallback(read):
+    """
+    Run `read(session)` in a read-only block. If it returns None from a
+    read replica, run it again on the primary: a row written by an
+    earlier request, such as a token login just created, may not have
+    reached the replica yet.
+
+    :param read: callable that takes a session and returns None when
+        nothing was found
+    :return: what `read` returned
+    """
+    with db_session_manager(read_only=True) as s:
+        result = read(s)
+        on_replica = s.info.get("replica", False)
+
+    if result is None and on_replica:
+        with db_session_manager() as s:
+            result = read(s)
+    return result
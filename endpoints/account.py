@@ -1,43 +1,118 @@
-from bcrypt import gensalt, hashpw
-from flask_jsonrpc import JSONRPCBlueprint
-from sqlalchemy import and_
+from typing import Optional, Union
 
-from database import db_session_manager
+from sqlalchemy import and_, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import db_session_manager, read_with_primary_fallback, release_connection
+from endpoints.auth import token_lifetime
+from helpers.account_cache import account_cache
+from helpers.exceptions import HashingQueueFull
+from helpers.jsonrpc import APIBlueprint, batch_cached
+from helpers.password import password_hasher
 from helpers.response import Response
+from helpers.signed_token import signed_tokens
+from helpers.token import is_api_token
+from helpers.token_cache import token_cache
 from logger import CustomLogger
 from models.api import Token, Account
 
-account = JSONRPCBlueprint("account", __name__)
+account = APIBlueprint("account", __name__)
 log = CustomLogger()
 
+ACCOUNT_BULK_MAX_ITEMS = 50  # Accounts per create_accounts call, at ~0.3s of bcrypt each this fits the request timeout.
+ACCOUNT_BULK_BATCH_SIZE = 25  # Accounts hashed and inserted per transaction by create_accounts.
+LOGINS_PAGE_SIZE = 100  # Default page size of get_logins_for_account.
+LOGINS_MAX_PAGE_SIZE = 1000  # Largest page size a caller may ask for.
+LOGINS_YIELD_PER = 200  # Rows fetched from the database cursor at a time.
+LOGIN_FIELDS = ("login_code", "uid", "admin_level")  # Fields get_logins_for_account can return.
 
-def get_account_info_by_token(account_code: str, key: str) -> Response:
-    with db_session_manager() as s:
 
-        try:
-            token_record = s.query(Token).filter(Token.key == key).one()
-        except Exception as e:
+@batch_cached
+def get_account_info_by_token(account_code: str, key: str) -> Response:
+    if signed_tokens.is_signed(key):
+        account_info = signed_tokens.verify(account_code, key)
+        if account_info is None:
             return Response(code="error", message="token not present")
+        return Response(code="ok", message="account info retrieved", **account_info)
 
-        try:
-            account_record = s.query(
-                Account
-            ).filter(
-                Account.id == token_record.account_id
-            ).filter(
-                Account.code == account_code
-            ).one()
-        except Exception as e:
-            return Response(code="error", message="account not present")
-
-        account_info = {
-            "uid": account_record.uid,
-            "login_code": account_record.login_code,
-            "admin_level": account_record.admin_level,
-        }
+    if not is_api_token(key):
+        return Response(code="error", message="token not present")
 
+    account_info = token_cache.get(account_code, key)
+    if account_info is not None:
         return Response(code="ok", message="account info retrieved", **account_info)
 
+    def read(s: Session) -> Union[tuple, None]:
+        token_record = s.query(Token).filter(Token.key == key).one_or_none()
+        if token_record is None:
+            return None
+
+        account_record = s.query(
+            Account
+        ).filter(
+            Account.id == token_record.account_id
+        ).filter(
+            Account.code == account_code
+        ).one_or_none()
+        return token_record, account_record
+
+    try:
+        found = read_with_primary_fallback(read)
+    except Exception as e:
+        return Response(code="error", message="token not present")
+
+    if found is None:
+        return Response(code="error", message="token not present")
+    token_record, account_record = found
+    if account_record is None:
+        return Response(code="error", message="account not present")
+
+    account_info = {
+        "uid": account_record.uid,
+        "login_code": account_record.login_code,
+        "admin_level": account_record.admin_level,
+    }
+    token_cache.put(
+        account_code,
+        key,
+        account_info,
+        valid_until=token_lifetime.effective_valid_until(token_record.id, token_record.valid_until),
+    )
+
+    return Response(code="ok", message="account info retrieved", **account_info)
+
+
+def check_new_account(
+        account_info: dict,
+        login_code: str,
+        login_secret_1: str,
+        login_secret_2: str,
+        admin_level: int
+) -> Union[Response, None]:
+    """
+    Check whether the requester described by `account_info` may create
+    the given account.
+
+    :return: None if the account may be created, else an error Response
+    """
+    if account_info.get("admin_level", "0") < admin_level:
+        return Response(
+            code="error",
+            message="admin_level not sufficient",
+            help=f"user with level {account_info.get('admin_level')} cannot create account with level {admin_level}"
+        )
+
+    if login_code == "":
+        return Response(code="error", message="login code empty")
+
+    if login_secret_1 == "" or login_secret_2 == "":
+        return Response(code="error", message="password empty")
+    elif login_secret_1 != login_secret_2:
+        return Response(code="error", message="passwords do not match")
+
+    return None
+
 
 @account.method("create_account")
 def create_account(
@@ -53,29 +128,21 @@ def create_account(
     if account_info_response.code == "error":
         return Response(code="error", message="no account for token", error=account_info_response.message).to_json()
 
-    if account_info_response.code == "ok":
-        account_info = account_info_response.optional_fields
+    error = check_new_account(
+        account_info_response.optional_fields, login_code, login_secret_1, login_secret_2, admin_level
+    )
+    if error is not None:
+        return error.to_json()
 
-        if account_info.get("admin_level", "0") < admin_level:
-            return Response(
-                code="error",
-                message="admin_level not sufficient",
-                help=f"user with level {account_info.get('admin_level')} cannot create account with level {admin_level}"
-            ).to_json()
-
-    if login_code == "":
-        return Response(code="error", message="login code empty").to_json()
-
-    if login_secret_1 == "" or login_secret_2 == "":
-        return Response(code="error", message="password empty").to_json()
-    elif login_secret_1 != login_secret_2:
-        return Response(code="error", message="passwords do not match").to_json()
+    release_connection()
+    try:
+        hashed_password = password_hasher.hash_password(login_secret_1.encode())
+    except HashingQueueFull as e:
+        return Response(code="error", message="server busy", help=str(e)).to_json()
+    log.debug(hashed_password)
 
     with db_session_manager() as s:
 
-        salt = gensalt()
-        hashed_password = hashpw(password=login_secret_1.encode(), salt=salt)
-        log.debug(hashed_password)
         new_account = Account()
         new_account.code = account_code
         new_account.login_code = login_code
@@ -93,6 +160,8 @@ def create_account(
                 message="failure saving account",
                 help=str(e)
             ).to_json()
+        finally:
+            account_cache.invalidate(account_code, login_code)
 
         return Response(
             code="ok",
@@ -101,37 +170,284 @@ def create_account(
         ).to_json()
 
 
-def validate_token(account_code: str, key: str) -> Response:
+def insert_accounts(account_code: str, rows: list) -> dict:
+    """
+    Insert `rows` with one multi-row INSERT. If that hits a unique
+    constraint, e.g. because a login code was taken after it was checked,
+    the rows are inserted one at a time so only the conflicting ones fail.
+
+    :param account_code: account code of the new accounts
+    :param rows: dicts with login_code, login_secret and admin_level
+    :return: {login_code: error message} for the rows that were not inserted
+    """
+    values = [{**row, "code": account_code} for row in rows]
+    failed = {}
+
     with db_session_manager() as s:
         try:
-            token = s.query(Account).join(Token).filter(Account.code == account_code).filter(Token.key == key).one()
-        except Exception as e:
-            return Response(code="error", message="token validation failed", help=str(e))
+            s.execute(insert(Account), values)
+            s.commit()
+            return failed
+        except IntegrityError:
+            s.rollback()
+
+        for row in values:
+            try:
+                s.execute(insert(Account), row)
+                s.commit()
+            except IntegrityError:
+                s.rollback()
+                failed[row["login_code"]] = "login code already exists"
+            except Exception as e:
+                s.rollback()
+                failed[row["login_code"]] = "failure saving account"
+
+    return failed
+
+
+@account.method("create_accounts")
+def create_accounts(account_code: str, key: str, accounts: list) -> dict:
+    """
+    Create many accounts in one call. The requester is authorized once,
+    passwords are hashed a few at a time (PASSWORD_HASH_BULK_JOBS) so
+    logins keep their share of the hashing pool, and the accounts are
+    inserted in batches of ACCOUNT_BULK_BATCH_SIZE. An account that
+    cannot be created does not stop the others.
 
+    :param account_code: account code of the requester and the new accounts
+    :param key: the api_key of the requester
+    :param accounts: [{"login_code": "...", "login_secret": "...", "admin_level": 0}, ...]
+    :return: {
+        "created": <number of accounts created>,
+        "failed": <number of accounts not created>,
+        "results": [{"login_code": "...", "code": "ok"|"error", "message": "..."}, ...]
+    } with one result per item of `accounts`, in the same order.
+    """
+    account_info_response = get_account_info_by_token(account_code=account_code, key=key)
+
+    if account_info_response.code == "error":
+        return Response(code="error", message="no account for token", error=account_info_response.message).to_json()
+
+    if len(accounts) > ACCOUNT_BULK_MAX_ITEMS:
+        return Response(
+            code="error",
+            message="too many accounts",
+            help=f"at most {ACCOUNT_BULK_MAX_ITEMS} accounts can be created per call"
+        ).to_json()
+
+    account_info = account_info_response.optional_fields
+    results = [None] * len(accounts)
+    pending = []
+    seen = set()
+
+    for index, item in enumerate(accounts):
+        login_code = item.get("login_code", "") if isinstance(item, dict) else None
+        login_secret = item.get("login_secret", "") if isinstance(item, dict) else None
+        admin_level = item.get("admin_level", 0) if isinstance(item, dict) else None
+
+        if not isinstance(login_code, str) or not isinstance(login_secret, str) or not isinstance(admin_level, int):
+            results[index] = Response(code="error", message="invalid account")
+            continue
+
+        error = check_new_account(account_info, login_code, login_secret, login_secret, admin_level)
+        if error is None and login_code in seen:
+            error = Response(code="error", message="duplicate login code in request")
+        if error is not None:
+            results[index] = error
+            continue
+
+        seen.add(login_code)
+        pending.append((index, login_code, login_secret, admin_level))
+
+    for start in range(0, len(pending), ACCOUNT_BULK_BATCH_SIZE):
+        batch = pending[start:start + ACCOUNT_BULK_BATCH_SIZE]
+
+        with db_session_manager() as s:
+            existing = {
+                login_code for login_code, in s.query(
+                    Account.login_code
+                ).filter(
+                    Account.login_code.in_([login_code for _, login_code, _, _ in batch])
+                )
+            }
+
+        for index, login_code, _, _ in batch:
+            if login_code in existing:
+                results[index] = Response(code="error", message="login code already exists")
+        batch = [item for item in batch if item[1] not in existing]
+        if not batch:
+            continue
+
+        release_connection()
+        try:
+            hashed_passwords = password_hasher.hash_passwords([secret.encode() for _, _, secret, _ in batch])
+        except HashingQueueFull as e:
+            for index, _, _, _ in pending[start:]:
+                if results[index] is None:
+                    results[index] = Response(code="error", message="server busy", help=str(e))
+            break
+
+        failed = insert_accounts(account_code, [
+            {"login_code": login_code, "login_secret": hashed_password, "admin_level": admin_level}
+            for (_, login_code, _, admin_level), hashed_password in zip(batch, hashed_passwords)
+        ])
+
+        for index, login_code, _, _ in batch:
+            account_cache.invalidate(account_code, login_code)
+            if login_code in failed:
+                results[index] = Response(code="error", message=failed[login_code])
+            else:
+                results[index] = Response(code="ok", message="new account created")
+
+    created = sum(1 for result in results if result.code == "ok")
+    log.info(f"Bulk created {created} of {len(accounts)} account(s)")
+
+    return Response(
+        code="ok",
+        message="accounts processed",
+        created=created,
+        failed=len(accounts) - created,
+        results=[
+            {"login_code": item.get("login_code") if isinstance(item, dict) else None, **result.to_json()}
+            for item, result in zip(accounts, results)
+        ]
+    ).to_json()
+
+
+@batch_cached
+def validate_token(account_code: str, key: str) -> Response:
+    if signed_tokens.is_signed(key):
+        if signed_tokens.verify(account_code, key) is None:
+            return Response(code="error", message="token validation failed")
+        return Response(code="ok", message="token validated")
+
+    if not is_api_token(key):
+        return Response(code="error", message="token validation failed")
+
+    if token_cache.get(account_code, key) is not None:
         return Response(code="ok", message="token validated")
 
+    def read(s: Session) -> Union[tuple, None]:
+        return s.query(
+            Account, Token.id, Token.valid_until
+        ).join(
+            Token
+        ).filter(
+            Account.code == account_code
+        ).filter(
+            Token.key == key
+        ).one_or_none()
+
+    try:
+        found = read_with_primary_fallback(read)
+    except Exception as e:
+        return Response(code="error", message="token validation failed")
+
+    if found is None:
+        return Response(code="error", message="token validation failed")
+    account_record, token_id, valid_until = found
+
+    account_info = {
+        "uid": account_record.uid,
+        "login_code": account_record.login_code,
+        "admin_level": account_record.admin_level,
+    }
+    token_cache.put(
+        account_code,
+        key,
+        account_info,
+        valid_until=token_lifetime.effective_valid_until(token_id, valid_until),
+    )
+
+    return Response(code="ok", message="token validated")
+
 
 @account.method("get_logins_for_account")
-def get_account(account_code: str, key: str, lc: str = "") -> dict:
+def get_account(
+        account_code: str,
+        key: str,
+        lc: str = "",
+        after: int = 0,
+        limit: int = LOGINS_PAGE_SIZE,
+        fields: Optional[list] = None
+) -> dict:
     """
+    List the logins of an account code one page at a time, ordered by
+    account id. Pass the returned `next` as `after` to get the next page;
+    `next` is None on the last page.
+
     :param account_code: account code of the requester
     :param key: the api_key of the requester
-    :param lc: the login_code for the account being queried
+    :param lc: the login_code for the account being queried, empty for all logins
+    :param after: cursor returned by the previous page, 0 for the first page
+    :param limit: logins per page, at most LOGINS_MAX_PAGE_SIZE
+    :param fields: the fields to return, default all of LOGIN_FIELDS
     :return: {
-        "login_code": "jantje@gmail.com"
-        "uid": "<uid>"
-        "api_key": "<the api key>"
-        "admin_level": 0-5
+        "logins": [{
+            "login_code": "jantje@gmail.com"
+            "uid": "<uid>"
+            "admin_level": 0-5
+        }, ...]
+        "next": <cursor of the next page>
     }
     """
     response = validate_token(account_code, key)
     if response.code == "error":
         return response.to_json()
 
-    with db_session_manager() as s:
-        s.query(Account).filter(
-            and_(
-                Account.code == account_code,
-                Account.login_code == lc
-            )
+    if fields is None:
+        fields = list(LOGIN_FIELDS)
+    unknown = [field for field in fields if field not in LOGIN_FIELDS]
+    if unknown or not fields:
+        return Response(
+            code="error",
+            message="invalid fields",
+            help=f"fields should be one or more of: {', '.join(LOGIN_FIELDS)}"
+        ).to_json()
+
+    if limit < 1 or limit > LOGINS_MAX_PAGE_SIZE:
+        return Response(
+            code="error",
+            message="invalid limit",
+            help=f"limit should be between 1 and {LOGINS_MAX_PAGE_SIZE}"
+        ).to_json()
+
+    # Only the requested columns are selected, no Account objects are built.
+    columns = [getattr(Account, field) for field in fields]
+
+    query_filter = [Account.code == account_code, Account.id > after]
+    if lc != "":
+        query_filter.append(Account.login_code == lc)
+
+    logins = []
+    last_id = None
+    with db_session_manager(read_only=True) as s:
+        # One row more than the page tells whether there is a next page.
+        rows = s.query(
+            Account.id, *columns
+        ).filter(
+            and_(*query_filter)
+        ).order_by(
+            Account.id
+        ).limit(
+            limit + 1
+        ).execution_options(
+            stream_results=True
+        ).yield_per(
+            LOGINS_YIELD_PER
         )
+
+        for row in rows:
+            if len(logins) == limit:
+                break
+            last_id = row[0]
+            logins.append(dict(zip(fields, row[1:])))
+        else:
+            last_id = None
+
+    return Response(
+        code="ok",
+        message="logins retrieved",
+        logins=logins,
+        next=last_id
+    ).to_json()
@@ -1,133 +1,161 @@
 from datetime import datetime, timedelta
 from typing import Union
 
-import bcrypt
-from flask_jsonrpc import JSONRPCBlueprint
-from sqlalchemy import and_
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, delete, insert, select, update
 
-from database import db_session_manager
+from database import db_session_manager, release_connection
 from getuid import generate_uid
+from helpers.account_cache import account_cache
+from helpers.exceptions import HashingQueueFull
+from helpers.jsonrpc import APIBlueprint
+from helpers.password import password_hasher
 from helpers.response import Response
-from helpers.token import generate_api_token
+from helpers.signed_token import signed_tokens
+from helpers.token import generate_api_token, is_api_token
+from helpers.token_cache import token_cache
+from helpers.token_expiry import TokenLifetime
 from logger import CustomLogger
 from models.api import Account, Token
 
-auth = JSONRPCBlueprint("auth", __name__)
+auth = APIBlueprint("auth", __name__)
 log = CustomLogger()
 
 EXPIRATION_ATTRIBUTE = "days"  # Timedelta: weeks, days, hours, minutes or seconds.
 TOKEN_EXPIRATION_DELTA = 1  # Tokens are invalid after (x) EXPIRATION_ATTRIBUTE.
 
+token_lifetime = TokenLifetime(lifetime=timedelta(**{EXPIRATION_ATTRIBUTE: TOKEN_EXPIRATION_DELTA}))
 
-def get_account_from_database(account_code: str, login_code: str) -> Union[Account, None]:
-    with db_session_manager() as session:
-        result = session.query(
-            Account
+
+def expired_token_cutoff() -> datetime:
+    """
+    Tokens with a valid_until before this moment have expired and are
+    no longer reused at login; the token reaper deletes them.
+    """
+    return datetime.now() - timedelta(**{EXPIRATION_ATTRIBUTE: TOKEN_EXPIRATION_DELTA})
+
+
+def get_account_and_token(account_code: str, login_code: str) -> Union[tuple, None]:
+    """
+    Fetch the account and its longest valid token with a single SELECT.
+
+    :param account_code: account code (eg company code)
+    :param login_code: login code (eg username or emailaddress)
+    :return: (Account, token id, token key, token valid_until), the token
+        fields are None when the account has no valid token.
+        None if there is no account.
+    """
+    hit, account = account_cache.get(account_code, login_code)
+    if hit:
+        if account is None:
+            return None
+        if signed_tokens.enabled:
+            # Signed tokens are not stored, there is no token to look up.
+            return account, None, None, None
+        return (account, *get_valid_token(account))
+
+    with db_session_manager() as s:
+        result = s.query(
+            Account, Token.id, Token.key, Token.valid_until
+        ).outerjoin(
+            Token,
+            and_(
+                Token.account_id == Account.id,
+                Token.valid_until >= expired_token_cutoff()
+            )
         ).filter(
             and_(
                 Account.login_code == login_code,
                 Account.code == account_code
             )
-        ).all()
-
-        num_records = len(result)
+        ).order_by(
+            Token.valid_until.desc().nullslast()
+        ).first()
 
-        log.debug(f"get_account_from_database: accounts found {num_records}")
+        log.debug(f"get_account_and_token: account found {result is not None}")
 
-        if num_records == 0 or num_records > 1:
-            return None
-        elif len(result) == 1:
-            return result[0]
+    account_cache.put(account_code, login_code, result[0] if result is not None else None)
+    return result
 
 
-def clear_expired_tokens_for_login_code(account: Account):
+def get_valid_token(account: Account) -> tuple:
     """
-    Get all the tokens in the database for the given account.
-    If the token is expired, delete it from the database.
-    :param account: The Account object for which to get the tokens for.
-    :return: Nothing
+    Fetch the longest valid token of an account that came from the
+    account cache.
+
+    :param account: Account object of the account that logs in
+    :return: (token id, token key, token valid_until), all None when
+        the account has no valid token.
     """
     with db_session_manager() as s:
-        result = s.query(Token).filter(Token.account_id == account.id).all()
-
-        count = 0
-        for token in result:
-            if datetime.now() - timedelta(**{EXPIRATION_ATTRIBUTE: TOKEN_EXPIRATION_DELTA}) > token.valid_until:
-                # token has expired, delete it.
-                log.debug(f"token.id {token.id} has expired. Deleting token.")
-                s.delete(token)
-                count += 1
-        try:
-            s.commit()
-        except Exception as e:
-            raise Exception(f"Could not delete expired tokens for account '{account.login_code}', {str(e)}")
+        token = s.query(
+            Token.id, Token.key, Token.valid_until
+        ).filter(
+            Token.account_id == account.id
+        ).filter(
+            Token.valid_until >= expired_token_cutoff()
+        ).order_by(
+            Token.valid_until.desc()
+        ).first()
 
-        log.debug(f"Cleared {count} token(s)")
+    if token is None:
+        return None, None, None
+    return tuple(token)
 
 
-def extend_token_lifetime(s: Session, token: Token) -> Response:
+def renew_token_for_account(account: Account, token_id: int = None, valid_until: datetime = None) -> Response:
     """
-    Extend the lifetime for the token with TOKEN_EXPIRATION_DELTA
-
-    :param s: SQLAlchemy Session
-    :param token:
-    :return: Response
-        ok: "lifetime extended"
-        error: "failed to extend lifetime"
-    """
-
-    token.valid_until = token.valid_until + timedelta(**{EXPIRATION_ATTRIBUTE: TOKEN_EXPIRATION_DELTA})
-    s.add(token)
-    try:
-        log.debug("Extending token lifetime")
-        s.commit()
-        return Response(code="ok", message="lifetime extended")
-    except Exception as e:
-        return Response(code="error", message="failed to extend lifetime")
-
-
-def check_api_key_for_account_login_code(account: Account) -> Response:
-    """
-    Check if there is a token in the database for the
-    given account. If there is a token, check it's expiration
-    datetime. Extend it if the token is still valid or create
-    a new token if the current token has expired.
-
-    :param account: Account object of the account to be checked
+    Extend the token found by get_account_and_token, or create a new
+    token if there is none or it was reaped in the meantime. Runs as a
+    single transaction of one UPDATE and/or one INSERT. No statement is
+    issued when token_lifetime skips or buffers the extension.
+
+    :param account: Account object of the account that logged in
+    :param token_id: id of the token to extend
+    :param valid_until: valid_until of the token to extend
     :return: Response
         ok: token lifetime extended
         ok: token created
         error: store token failure
-
     """
-
-    clear_expired_tokens_for_login_code(account)
+    if token_id is not None:
+        new_valid_until = token_lifetime.extended_valid_until(token_id, valid_until)
+        if new_valid_until is None or token_lifetime.defer(token_id, new_valid_until):
+            return Response(code="ok", message="token lifetime extended")
 
     with db_session_manager() as s:
-        # We'll use the first token if there are more than one
-        token = s.query(Token).filter(Token.account_id == account.id).first()
-
-        # If there are no tokens, create a new one for the account.
-        if token is None:
-            new_token = Token()
-            new_token.key = generate_api_token()
-            new_token.valid_until = datetime.now() + timedelta(**{EXPIRATION_ATTRIBUTE: TOKEN_EXPIRATION_DELTA})
-            new_token.account_id = account.id
-            new_token.uid = generate_uid()
-            s.add(new_token)
-            try:
-                s.commit()
-                log.debug("Created new token")
-                return Response(code="ok", message="token created", api_key=new_token.key)
-            except Exception as e:
-                return Response(code="error", message="store token failure")
-        else:
-            response = extend_token_lifetime(s, token)
-            if response.code == "ok":
-                return Response(code="ok", message="token lifetime extended", api_key=token.key)
-            else:
-                return response
+        try:
+            if token_id is not None:
+                result = s.execute(
+                    update(
+                        Token
+                    ).where(
+                        Token.id == token_id
+                    ).values(
+                        valid_until=new_valid_until
+                    ).execution_options(
+                        synchronize_session=False
+                    )
+                )
+                if result.rowcount == 1:
+                    # Cached entries never outlive the old valid_until, extending needs no invalidation.
+                    s.commit()
+                    return Response(code="ok", message="token lifetime extended")
+
+            key = generate_api_token()
+            s.execute(
+                insert(Token).values(
+                    key=key,
+                    valid_until=datetime.now() + timedelta(**{EXPIRATION_ATTRIBUTE: TOKEN_EXPIRATION_DELTA}),
+                    account_id=account.id,
+                    uid=generate_uid(),
+                )
+            )
+            s.commit()
+            log.debug("Created new token")
+            return Response(code="ok", message="token created", api_key=key)
+        except Exception as e:
+            s.rollback()
+            return Response(code="error", message="store token failure")
 
 
 @auth.method("login")
@@ -141,18 +169,35 @@ def login(ac: str, lc: str, ls: str) -> dict:
     """
     log.debug("Starting Authentication Process")
 
-    account = get_account_from_database(ac, lc)
-    if account is None:
+    # The password check runs between the read and the write so no
+    # connection is held while bcrypt is busy.
+    result = get_account_and_token(ac, lc)
+    if result is None:
         return Response("error", "No Account Found").to_json()
 
-    if bcrypt.checkpw(ls.encode(), account.login_secret):
+    account, token_id, token_key, token_valid_until = result
+
+    release_connection()
+    try:
+        password_valid = password_hasher.check_password(ls.encode(), account.login_secret)
+    except HashingQueueFull as e:
+        return Response("error", "server busy", help=str(e)).to_json()
+
+    if password_valid:
         login_success = True
     else:
         return Response("error", "invalid credentials").to_json()
 
-    response = check_api_key_for_account_login_code(account)
+    if signed_tokens.enabled:
+        # Signed tokens are verified without a database lookup, nothing is stored.
+        key = signed_tokens.issue(account, datetime.now() + token_lifetime.lifetime)
+        val = Response("ok", "logged in", api_key=key).to_json()
+        log.debug("Issued signed token")
+        return val
+
+    response = renew_token_for_account(account, token_id, token_valid_until)
     if response.code == "ok":
-        key = response.optional_fields.get("api_key")
+        key = response.optional_fields.get("api_key", token_key)
     else:
         return Response(
             code="error",
@@ -163,3 +208,46 @@ def login(ac: str, lc: str, ls: str) -> dict:
         val = Response("ok", "logged in", api_key=key).to_json()
         log.debug(val)
         return val
+
+
+@auth.method("logout")
+def logout(ac: str, key: str) -> dict:
+    """
+    Revoke an api key. A signed key is put on the deny-list until it
+    expires, an opaque key is deleted.
+
+    :param ac: account code (eg company code)
+    :param key: the api_key to revoke
+    :return: JSON Response
+    """
+    if signed_tokens.is_signed(key):
+        if not signed_tokens.revoke(ac, key):
+            return Response("error", "invalid token").to_json()
+        return Response("ok", "logged out").to_json()
+
+    if not is_api_token(key):
+        return Response("error", "invalid token").to_json()
+
+    with db_session_manager() as s:
+        try:
+            result = s.execute(
+                delete(
+                    Token
+                ).where(
+                    Token.key == key
+                ).where(
+                    Token.account_id.in_(select(Account.id).where(Account.code == ac))
+                ).execution_options(
+                    synchronize_session=False
+                )
+            )
+            s.commit()
+        except Exception as e:
+            s.rollback()
+            return Response("error", "invalid token").to_json()
+        finally:
+            token_cache.invalidate(key)
+
+    if result.rowcount == 0:
+        return Response("error", "invalid token").to_json()
+    return Response("ok", "logged out").to_json()
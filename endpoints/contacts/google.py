@@ -1,6 +1,5 @@
-from flask_jsonrpc import JSONRPCBlueprint
-
+from helpers.jsonrpc import APIBlueprint
 from logger import CustomLogger
 
-google_contacts = JSONRPCBlueprint("contacts", __name__)
+google_contacts = APIBlueprint("contacts", __name__)
 log = CustomLogger()
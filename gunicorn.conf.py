@@ -0,0 +1,117 @@
+"""
+gunicorn configuration, loaded automatically by `gunicorn app:app` from
+the repository root.
+
+GUNICORN_WORKER_PROFILE picks a worker class for this app's mix of
+endpoints, where login and create_account spend most of their time in
+bcrypt and everything else waits on the database:
+
+    sync      2 x cores + 1 single threaded workers. Simple and robust;
+              set PASSWORD_HASH_WORKERS to 1 so the hashing processes of
+              all workers together do not exceed the cores.
+    threaded  gthread workers, one per core, GUNICORN_THREADS threads
+              each. Database waits release the GIL and bcrypt runs in
+              the password hashing pool, so threads mostly wait on I/O.
+              Use this by default.
+    gevent    Asynchronous mode: one gevent worker per core, every
+              request runs in a greenlet that yields while it waits on
+              the database or the hashing pool, so the number of
+              requests in flight is bounded by GUNICORN_WORKER_CONNECTIONS
+              and DATABASE_POOL_SIZE instead of by threads. Needs gevent,
+              and psycogreen for psycopg2 to yield while it waits. bcrypt
+              must stay in the hashing pool (PASSWORD_HASH_WORKERS > 0)
+              or it blocks the event loop.
+
+With GUNICORN_PRELOAD (default on) the app is imported once in the master
+and shared copy-on-write by the workers. The hooks below make that safe:
+the master stops its background threads and flushes its log writer before
+forking, and every worker empties the inherited connection pool and starts
+its own background threads. The metrics snapshot directory is emptied when
+the server starts and every worker removes its own snapshot when it exits.
+"""
+import multiprocessing
+import os
+
+CORES = multiprocessing.cpu_count()
+
+WORKER_PROFILES = {
+    "sync": {
+        "worker_class": "sync",
+        "workers": 2 * CORES + 1,
+        "threads": 1,
+    },
+    "threaded": {
+        "worker_class": "gthread",
+        "workers": CORES,
+        "threads": int(os.environ.get("GUNICORN_THREADS", 8)),
+    },
+    "gevent": {
+        "worker_class": "gevent",
+        "workers": CORES,
+        "threads": 1,
+        "worker_connections": int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 200)),
+    },
+}
+
+worker_profile = os.environ.get("GUNICORN_WORKER_PROFILE", "threaded")
+if worker_profile not in WORKER_PROFILES:
+    raise ValueError(f"Unknown GUNICORN_WORKER_PROFILE '{worker_profile}', use one of: {', '.join(WORKER_PROFILES)}")
+
+profile = WORKER_PROFILES[worker_profile]
+
+if profile["worker_class"] == "gevent":
+    # Patch before a preloaded app is imported, otherwise the locks and
+    # queues it creates at import block the whole worker instead of
+    # only the waiting greenlet.
+    from gevent import monkey
+
+    monkey.patch_all()
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+worker_class = profile["worker_class"]
+workers = int(os.environ.get("GUNICORN_WORKERS", profile["workers"]))
+threads = profile["threads"]
+worker_connections = profile.get("worker_connections", 1000)
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = 30
+keepalive = 5
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = max_requests // 10
+
+
+def post_fork(server, worker):
+    if worker_class == "gevent":
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            server.log.warning("psycogreen is not installed, psycopg2 will block the gevent worker")
+        else:
+            patch_psycopg()
+
+    if server.cfg.preload_app:
+        from init_app import after_fork
+
+        after_fork(worker.app.wsgi())
+
+
+def pre_fork(server, worker):
+    if server.cfg.preload_app:
+        from init_app import before_fork
+
+        before_fork()
+
+
+def on_starting(server):
+    # Snapshots of an earlier run must not be added to the new totals.
+    from helpers.metrics import registry
+
+    registry.clear_directory()
+
+
+def worker_exit(server, worker):
+    from helpers.metrics import registry
+    from logger import CustomLogger
+
+    CustomLogger().shutdown()
+    registry.close()
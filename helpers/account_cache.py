@@ -0,0 +1,173 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Union
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from models.api import Account
+
+ACCOUNT_CACHE_SIZE = 10000  # Maximum number of accounts kept in memory.
+ACCOUNT_CACHE_TTL = 60  # Seconds a cached account, with its secret and admin level, is used without asking the database.
+ACCOUNT_CACHE_NEGATIVE_SIZE = 10000  # Maximum number of unknown (account_code, login_code) pairs kept in memory.
+ACCOUNT_CACHE_NEGATIVE_TTL = 5  # Seconds an unknown (account_code, login_code) pair is answered without the database.
+
+
+class AccountCache(object):
+    """
+    Bounded in-process cache of (account_code, login_code) -> account, so
+    repeated logins for the same account, and logins for login codes that
+    do not exist, do not each run a query.
+
+    Accounts are kept for `ttl` seconds, which bounds how long a changed
+    secret or admin level can be served from the cache. Misses are kept
+    apart, for the shorter `negative_ttl`, in their own LRU so a flood of
+    unknown login codes cannot push out the known accounts.
+
+    create_account and create_accounts invalidate the pair they insert in
+    this process. Other processes answer "no account" for a new login
+    code for at most `negative_ttl` seconds.
+    """
+
+    def __init__(
+            self,
+            max_size: int = ACCOUNT_CACHE_SIZE,
+            ttl: float = ACCOUNT_CACHE_TTL,
+            negative_max_size: int = ACCOUNT_CACHE_NEGATIVE_SIZE,
+            negative_ttl: float = ACCOUNT_CACHE_NEGATIVE_TTL,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_max_size = negative_max_size
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._accounts = OrderedDict()
+        self._missing = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(
+            self,
+            max_size: int = None,
+            ttl: float = None,
+            negative_max_size: int = None,
+            negative_ttl: float = None,
+    ):
+        with self._lock:
+            if max_size is not None:
+                self.max_size = max_size
+            if ttl is not None:
+                self.ttl = ttl
+            if negative_max_size is not None:
+                self.negative_max_size = negative_max_size
+            if negative_ttl is not None:
+                self.negative_ttl = negative_ttl
+            self._trim(self._accounts, self.max_size)
+            self._trim(self._missing, self.negative_max_size)
+
+    def get(self, account_code: str, login_code: str) -> tuple:
+        """
+        :param account_code: account code (eg company code)
+        :param login_code: login code (eg username or emailaddress)
+        :return: (hit, account): (True, Account) for a cached account,
+            (True, None) for a pair cached as not existing and
+            (False, None) when the database has to be asked.
+            The Account is a new detached object on every call.
+        """
+        cache_key = (account_code, login_code)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._accounts.get(cache_key)
+            if entry is not None:
+                expires_at, columns = entry
+                if expires_at > now:
+                    self._accounts.move_to_end(cache_key)
+                    self.hits += 1
+                    return True, self._to_account(columns)
+                del self._accounts[cache_key]
+
+            expires_at = self._missing.get(cache_key)
+            if expires_at is not None:
+                if expires_at > now:
+                    self._missing.move_to_end(cache_key)
+                    self.negative_hits += 1
+                    return True, None
+                del self._missing[cache_key]
+
+            self.misses += 1
+            return False, None
+
+    def put(self, account_code: str, login_code: str, account: Union[Account, None]):
+        """
+        Store the result of looking up (account_code, login_code).
+
+        :param account_code: account code (eg company code)
+        :param login_code: login code (eg username or emailaddress)
+        :param account: the Account found, or None if there is none
+        :return: Nothing
+        """
+        cache_key = (account_code, login_code)
+
+        if account is None:
+            if self.negative_max_size <= 0 or self.negative_ttl <= 0:
+                return
+            with self._lock:
+                self._missing.pop(cache_key, None)
+                self._missing[cache_key] = time.monotonic() + self.negative_ttl
+                self._trim(self._missing, self.negative_max_size)
+            return
+
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+
+        columns = {attribute.key: getattr(account, attribute.key) for attribute in inspect(Account).column_attrs}
+        with self._lock:
+            self._missing.pop(cache_key, None)
+            self._accounts.pop(cache_key, None)
+            self._accounts[cache_key] = (time.monotonic() + self.ttl, columns)
+            self._trim(self._accounts, self.max_size)
+
+    def invalidate(self, account_code: str, login_code: str):
+        """
+        Drop what is cached for (account_code, login_code).
+        Call this whenever an account is created, changed or deleted.
+        """
+        cache_key = (account_code, login_code)
+        with self._lock:
+            self._accounts.pop(cache_key, None)
+            self._missing.pop(cache_key, None)
+
+    def clear(self):
+        with self._lock:
+            self._accounts.clear()
+            self._missing.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._accounts),
+                "negative_size": len(self._missing),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _trim(self, entries: OrderedDict, max_size: int):
+        while len(entries) > max(max_size, 0):
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    @staticmethod
+    def _to_account(columns: dict) -> Account:
+        # Detached, not transient: adding it to a session must not INSERT it again.
+        account = Account(**columns)
+        make_transient_to_detached(account)
+        return account
+
+
+account_cache = AccountCache()
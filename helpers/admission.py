@@ -0,0 +1,180 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Union
+
+from helpers.response import Response
+
+ADMISSION_ENABLED = True  # Check concurrency limits and rate limits before running a JSON-RPC method.
+ADMISSION_CONCURRENCY = {  # Calls of a method running at once in one worker, further calls are rejected.
+    "auth.login": 8,
+    "account.create_account": 4,
+    "account.create_accounts": 1,
+}
+ADMISSION_RATE_LIMITED_METHODS = ("auth.login",)  # Methods that take from the account code and login code buckets.
+ADMISSION_ACCOUNT_RATE = 20.0  # Calls per second refilled into the bucket of an account code.
+ADMISSION_ACCOUNT_BURST = 40  # Size of the bucket of an account code.
+ADMISSION_LOGIN_RATE = 0.2  # Calls per second refilled into the bucket of a login code.
+ADMISSION_LOGIN_BURST = 5  # Size of the bucket of a login code.
+ADMISSION_MAX_BUCKETS = 100000  # Buckets kept in memory, the least recently used are dropped first.
+
+
+class TokenBuckets(object):
+    """
+    One token bucket per key, holding at most `burst` tokens and refilled
+    with `rate` tokens per second. A bucket that is dropped to stay within
+    `max_buckets` starts full again, which only ever lets a call through.
+    """
+
+    def __init__(self, rate: float, burst: float, max_buckets: int = ADMISSION_MAX_BUCKETS):
+        self.rate = rate
+        self.burst = burst
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key) -> bool:
+        """
+        :return: True if `key` had a token left, which is now used
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = self.burst
+                if len(self._buckets) >= self.max_buckets:
+                    self._buckets.popitem(last=False)
+            else:
+                tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                self._buckets.move_to_end(key)
+
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return False
+
+            self._buckets[key] = (tokens - 1, now)
+            return True
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class AdmissionController(object):
+    """
+    Rejects JSON-RPC calls up front instead of letting them queue for a
+    thread, a database connection or the password hashing pool:
+
+    - a method in `concurrency` may run at most that many calls at once
+      in this process, further calls are rejected right away;
+    - a method in `rate_limited_methods` takes a token from the bucket of
+      the account code and from the bucket of the (account code, login
+      code) pair, so a flood against one account or one login is cut off
+      without slowing down the others.
+
+    All state is kept in memory, per process.
+    """
+
+    def __init__(self):
+        self.enabled = ADMISSION_ENABLED
+        self.concurrency = dict(ADMISSION_CONCURRENCY)
+        self.rate_limited_methods = frozenset(ADMISSION_RATE_LIMITED_METHODS)
+        self.account_buckets = TokenBuckets(ADMISSION_ACCOUNT_RATE, ADMISSION_ACCOUNT_BURST)
+        self.login_buckets = TokenBuckets(ADMISSION_LOGIN_RATE, ADMISSION_LOGIN_BURST)
+        self.rejected = 0
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def configure(
+            self,
+            enabled: bool = None,
+            concurrency: dict = None,
+            rate_limited_methods: list = None,
+            account_rate: float = None,
+            account_burst: float = None,
+            login_rate: float = None,
+            login_burst: float = None,
+            max_buckets: int = None,
+    ):
+        if enabled is not None:
+            self.enabled = enabled
+        if concurrency is not None:
+            self.concurrency = dict(concurrency)
+        if rate_limited_methods is not None:
+            self.rate_limited_methods = frozenset(rate_limited_methods)
+        self.account_buckets = TokenBuckets(
+            account_rate if account_rate is not None else self.account_buckets.rate,
+            account_burst if account_burst is not None else self.account_buckets.burst,
+            max_buckets if max_buckets is not None else self.account_buckets.max_buckets,
+        )
+        self.login_buckets = TokenBuckets(
+            login_rate if login_rate is not None else self.login_buckets.rate,
+            login_burst if login_burst is not None else self.login_buckets.burst,
+            max_buckets if max_buckets is not None else self.login_buckets.max_buckets,
+        )
+
+    def admit(self, method: str, params) -> Union[Response, None]:
+        """
+        Call release(method) when an admitted call has finished.
+
+        :param method: "<blueprint>.<method>"
+        :param params: the params of the JSON-RPC request
+        :return: None if the call may run, else the error Response to return
+        """
+        if not self.enabled:
+            return None
+
+        if method in self.rate_limited_methods and isinstance(params, dict):
+            account_code = params.get("ac", params.get("account_code"))
+            login_code = params.get("lc", params.get("login_code"))
+        else:
+            account_code = login_code = None
+
+        # Params of another type are rejected by the method's type checks, they are not bucket keys.
+        if isinstance(account_code, str) and isinstance(login_code, str):
+            if not self.account_buckets.take(account_code):
+                return self._reject("too many requests", "rate limit for account code exceeded, try again later")
+            if not self.login_buckets.take((account_code, login_code)):
+                return self._reject("too many requests", "rate limit for login code exceeded, try again later")
+
+        limit = self.concurrency.get(method)
+        if limit is not None:
+            with self._lock:
+                running = self._running.get(method, 0)
+                if running >= limit:
+                    over_capacity = True
+                else:
+                    over_capacity = False
+                    self._running[method] = running + 1
+            if over_capacity:
+                return self._reject("server busy", f"too many {method} calls in progress, try again later")
+
+        return None
+
+    def release(self, method: str):
+        if method not in self.concurrency:
+            return
+        with self._lock:
+            running = self._running.get(method, 0)
+            if running > 0:
+                self._running[method] = running - 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            running = dict(self._running)
+            rejected = self.rejected
+        return {
+            "enabled": self.enabled,
+            "running": running,
+            "rejected": rejected,
+            "account_buckets": len(self.account_buckets),
+            "login_buckets": len(self.login_buckets),
+        }
+
+    def _reject(self, message: str, help: str) -> Response:
+        with self._lock:
+            self.rejected += 1
+        return Response(code="error", message=message, help=help)
+
+
+admission = AdmissionController()
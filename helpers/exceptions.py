@@ -8,3 +8,7 @@ class UpdateError(Exception):
 
 class MismatchError(Exception):
     pass
+
+
+class HashingQueueFull(Exception):
+    pass
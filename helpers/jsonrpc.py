@@ -0,0 +1,180 @@
+import functools
+import inspect
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Union
+
+from flask import copy_current_request_context, current_app, g, has_app_context
+from flask_jsonrpc import JSONRPCBlueprint
+from flask_jsonrpc.exceptions import InvalidRequestError
+from flask_jsonrpc.site import JSONRPC_DEFAULT_HTTP_STATUS_CODE, JSONRPCSite
+from werkzeug.datastructures import Headers
+
+from database import shared_session
+from helpers.admission import admission
+from helpers.metrics import rpc_duration, rpc_rejected, rpc_requests
+
+JSONRPC_BATCH_CONCURRENCY = 1  # Threads running the calls of one batch, 1 runs them in order on one session.
+
+_batch_executor = None
+_batch_executor_pid = None
+_batch_executor_lock = threading.Lock()
+
+
+class BatchContext(object):
+    """
+    State shared by the calls of one JSON-RPC batch request. Results of
+    functions decorated with batch_cached are kept here.
+    """
+
+    def __init__(self):
+        self.results = {}
+        self.lock = threading.Lock()
+
+
+def current_batch() -> Union[BatchContext, None]:
+    if not has_app_context():
+        return None
+    return g.get("rpc_batch")
+
+
+def batch_cached(fn):
+    """
+    Run `fn` once per distinct set of arguments within one batch request,
+    e.g. to authenticate the same (account_code, key) only once. Outside
+    a batch `fn` is called as usual.
+    """
+    signature = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        batch = current_batch()
+        if batch is None:
+            return fn(*args, **kwargs)
+
+        key = (fn.__qualname__, tuple(signature.bind(*args, **kwargs).arguments.items()))
+        with batch.lock:
+            future = batch.results.get(key)
+            owner = future is None
+            if owner:
+                future = batch.results[key] = Future()
+
+        if owner:
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+        return future.result()
+
+    return wrapper
+
+
+def _get_batch_executor(workers: int) -> ThreadPoolExecutor:
+    global _batch_executor, _batch_executor_pid
+
+    with _batch_executor_lock:
+        if _batch_executor is None or _batch_executor_pid != os.getpid() or _batch_executor._max_workers != workers:
+            _batch_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rpc-batch")
+            _batch_executor_pid = os.getpid()
+        return _batch_executor
+
+
+class APISite(JSONRPCSite):
+    """
+    JSON-RPC site of an APIBlueprint. Calls are admitted by the
+    AdmissionController first, and the count, Response code and latency
+    of every call are recorded under "<blueprint>.<method>".
+
+    Batch requests share a BatchContext. With JSONRPC_BATCH_CONCURRENCY
+    at 1 the calls run in order on one shared session; above 1 they run
+    concurrently, each with its own session.
+    """
+
+    blueprint_name = None
+
+    def dispatch(self, req_json: Dict[str, Any]):
+        method = req_json.get("method")
+        label = f"{self.blueprint_name}.{method}" if method in self.view_funcs else "unknown"
+        code = "exception"
+        started = time.perf_counter()
+        try:
+            params = self.named_params(method, req_json.get("params"))
+            rejection = admission.admit(label, params) if label != "unknown" else None
+            if rejection is not None:
+                code = rejection.code
+                rpc_rejected.inc(label, rejection.message)
+                return self.make_response(req_json, rejection.to_json())
+
+            try:
+                response = super().dispatch(req_json)
+            finally:
+                admission.release(label)
+            result = response[0].get("result") if isinstance(response[0], dict) else None
+            code = result.get("code", "none") if isinstance(result, dict) else "none"
+            return response
+        finally:
+            rpc_duration.observe(time.perf_counter() - started, label)
+            rpc_requests.inc(label, code)
+
+    def named_params(self, method: str, params) -> Union[dict, list, None]:
+        """
+        :return: positional `params` as {argument name: value} of the
+            method's view function, so admission control sees them like
+            keyword params; other params as they are
+        """
+        if not isinstance(params, list) or method not in self.view_funcs:
+            return params
+        try:
+            return dict(inspect.signature(self.view_funcs[method]).bind_partial(*params).arguments)
+        except TypeError:
+            # Too many params, the call fails on dispatch; rate limit it as one without names.
+            return {}
+
+    def batch_dispatch(self, reqs_json: List[Dict[str, Any]]):
+        if not reqs_json:
+            raise InvalidRequestError(data={"message": "Empty array"})
+
+        batch = BatchContext()
+        concurrency = current_app.config.get("JSONRPC_BATCH_CONCURRENCY", JSONRPC_BATCH_CONCURRENCY)
+
+        if concurrency > 1 and len(reqs_json) > 1:
+            results = self._dispatch_concurrently(batch, reqs_json, concurrency)
+        else:
+            previous = g.get("rpc_batch")
+            g.rpc_batch = batch
+            try:
+                with shared_session():
+                    results = [self.handle_dispatch_except(rq) for rq in reqs_json]
+            finally:
+                g.rpc_batch = previous
+
+        resp_views = []
+        headers = Headers()
+        status_code = JSONRPC_DEFAULT_HTTP_STATUS_CODE
+        for rv, _, hdrs in results:
+            headers.update([hdrs] if isinstance(hdrs, tuple) else hdrs)
+            if rv is None:
+                continue
+            resp_views.append(rv)
+        if not resp_views:
+            status_code = 204
+        return resp_views, status_code, headers
+
+    def _dispatch_concurrently(self, batch: BatchContext, reqs_json: List[Dict[str, Any]], concurrency: int) -> list:
+        def run(req_json):
+            g.rpc_batch = batch
+            return self.handle_dispatch_except(req_json)
+
+        # Every call gets its own copy of the request context to push in its thread.
+        calls = [copy_current_request_context(functools.partial(run, rq)) for rq in reqs_json]
+        executor = _get_batch_executor(concurrency)
+        return [future.result() for future in [executor.submit(call) for call in calls]]
+
+
+class APIBlueprint(JSONRPCBlueprint):
+    def __init__(self, name: str, import_name: str):
+        super().__init__(name, import_name, jsonrpc_site=APISite)
+        self.jsonrpc_site.blueprint_name = name
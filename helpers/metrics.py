@@ -0,0 +1,345 @@
+import atexit
+import glob
+import json
+import os
+import secrets
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+METRICS_DIR = os.environ.get("METRICS_DIR")  # Shared directory for per-worker snapshots, None for one process.
+METRICS_FLUSH_INTERVAL = 5  # Seconds between snapshot writes of a worker.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Counter(object):
+    def __init__(self, name: str, help: str, label_names: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.values = {}
+
+    def inc(self, *label_values, value: float = 1):
+        with registry.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + value
+
+    def set(self, value: float, *label_values):
+        # For totals counted by another object and copied in by a collector.
+        with registry.lock:
+            self.values[label_values] = value
+
+
+class Gauge(Counter):
+    pass
+
+
+class Histogram(object):
+    def __init__(self, name: str, help: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, value: float, *label_values):
+        # Per label set: one count per bucket plus +Inf, then the sum.
+        index = bisect_left(self.buckets, value)
+        with registry.lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                counts = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+
+class MetricsRegistry(object):
+    """
+    In-process metric store.
+
+    Counters and histograms are plain dicts updated under one lock, so
+    an update costs a dict lookup and an addition. With a shared
+    `directory` every worker writes its snapshot to its own file every
+    `flush_interval` seconds and the text endpoint adds all snapshots
+    together, so a scrape that lands on any gunicorn worker sees the
+    totals of all of them. Snapshot file names are unique per process
+    lifetime, so a new worker that reuses a pid never overwrites the
+    file of an old one; clear_directory() at server start and close()
+    at worker exit remove files that no longer belong to a worker.
+    """
+
+    def __init__(self, directory: str = METRICS_DIR, flush_interval: float = METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self._collectors = {}
+        self._thread = None
+        self._stopped = threading.Event()
+        self._pid = None
+        self._snapshot_path = None
+        self._closed = False
+
+    def counter(self, name: str, help: str, label_names: tuple = ()) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, help, label_names))
+
+    def gauge(self, name: str, help: str, label_names: tuple = ()) -> Gauge:
+        return self.metrics.setdefault(name, Gauge(name, help, label_names))
+
+    def histogram(self, name: str, help: str, label_names: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, help, label_names, buckets))
+
+    def add_collector(self, name: str, collect):
+        """
+        Call `collect()` before every snapshot, to copy values kept
+        elsewhere into metrics. A second collector with the same name
+        replaces the first.
+        """
+        self._collectors[name] = collect
+
+    def configure(self, directory: str = None, flush_interval: float = None):
+        if directory is not None:
+            self.directory = directory
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._ensure_started()
+
+    def snapshot(self) -> dict:
+        for collect in list(self._collectors.values()):
+            collect()
+        with self.lock:
+            return {
+                name: [[list(labels), value] for labels, value in metric.values.items()]
+                for name, metric in self.metrics.items()
+            }
+
+    def write_snapshot(self):
+        if not self.directory or self._closed:
+            return
+
+        path = self._get_snapshot_path()
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    def clear_directory(self):
+        """
+        Remove the snapshot files of all workers. Call once when the
+        server starts, before any worker runs.
+        """
+        if not self.directory:
+            return
+        for path in glob.glob(os.path.join(self.directory, "metrics-*.json*")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stop(self):
+        """
+        Stop the thread that writes the snapshot file. configure()
+        starts it again.
+        """
+        self._stopped.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
+        self._thread = None
+
+    def close(self):
+        """
+        Stop writing snapshots and remove this process's file, so its
+        totals are no longer added to those of the running workers.
+        """
+        self.stop()
+        self._closed = True
+        atexit.unregister(self.write_snapshot)
+        path, self._snapshot_path = self._snapshot_path, None
+        if path is not None and self._pid == os.getpid():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def collect(self) -> dict:
+        """
+        :return: {metric name: {label values: value}} summed over all workers
+        """
+        if not self.directory:
+            snapshots = [self.snapshot()]
+        else:
+            self._ensure_started()
+            self.write_snapshot()
+            snapshots = []
+            for path in glob.glob(os.path.join(self.directory, "metrics-*.json")):
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+
+        totals = {name: {} for name in self.metrics}
+        for snapshot in snapshots:
+            for name, values in snapshot.items():
+                if name not in totals:
+                    continue
+                for labels, value in values:
+                    labels = tuple(labels)
+                    current = totals[name].get(labels)
+                    if current is None:
+                        totals[name][labels] = list(value) if isinstance(value, list) else value
+                    elif isinstance(value, list):
+                        totals[name][labels] = [a + b for a, b in zip(current, value)]
+                    else:
+                        totals[name][labels] = current + value
+        return totals
+
+    def render(self) -> str:
+        """
+        :return: all metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for name, values in self.collect().items():
+            metric = self.metrics[name]
+            if isinstance(metric, Histogram):
+                kind = "histogram"
+            elif isinstance(metric, Gauge):
+                kind = "gauge"
+            else:
+                kind = "counter"
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            for label_values, value in sorted(values.items()):
+                labels = [f'{k}="{v}"' for k, v in zip(metric.label_names, label_values)]
+                if kind != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ("+Inf",), value[:-1]):
+                    cumulative += count
+                    bucket_labels = labels + [f'le="{bound}"']
+                    lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {value[-1]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+
+        return "\n".join(lines) + "\n"
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+
+        # A forked worker writes its own snapshot file from its own thread.
+        self._pid = os.getpid()
+        self._snapshot_path = None
+        self._closed = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.write_snapshot)
+
+    def _get_snapshot_path(self) -> str:
+        if self._snapshot_path is None or self._pid != os.getpid():
+            self._snapshot_path = os.path.join(
+                self.directory, f"metrics-{os.getpid()}-{secrets.token_hex(4)}.json"
+            )
+        return self._snapshot_path
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.write_snapshot()
+            except OSError:
+                pass
+
+
+def _format_labels(labels: list) -> str:
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+registry = MetricsRegistry()
+
+rpc_requests = registry.counter(
+    "rpc_requests_total", "JSON-RPC calls by method and Response code.", ("method", "code")
+)
+rpc_rejected = registry.counter(
+    "rpc_rejected_total", "JSON-RPC calls rejected by admission control by method and reason.", ("method", "reason")
+)
+rpc_duration = registry.histogram(
+    "rpc_request_duration_seconds", "JSON-RPC call latency by method.", ("method",)
+)
+sql_duration = registry.histogram(
+    "sql_statement_duration_seconds", "SQL statement execution time.", buckets=SQL_BUCKETS
+)
+pool_checkout_wait = registry.histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled database connection.", buckets=SQL_BUCKETS
+)
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_checkout_wait.observe(time.perf_counter() - started)
+
+
+def export_stats(prefix: str, stats, counters: dict = None, gauges: dict = None):
+    """
+    Publish numbers from the stats() of a component as metrics, read at
+    every snapshot: counters as "<prefix>_<key>_total", gauges as
+    "<prefix>_<key>".
+
+    :param prefix: metric name prefix, e.g. "token_cache"
+    :param stats: callable returning a dict that has every key below
+    :param counters: {stats key: help} of values that only go up
+    :param gauges: {stats key: help} of values that go up and down
+    """
+    metrics = {}
+    for key, help in (counters or {}).items():
+        metrics[key] = registry.counter(f"{prefix}_{key}_total", help)
+    for key, help in (gauges or {}).items():
+        metrics[key] = registry.gauge(f"{prefix}_{key}", help)
+
+    def collect():
+        values = stats()
+        for key, metric in metrics.items():
+            metric.set(values[key])
+
+    registry.add_collector(prefix, collect)
+
+
+def instrument_engine(engine):
+    """
+    Record the count and duration of every SQL statement run on `engine`.
+    """
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine, "handle_error", _handle_error)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    sql_duration.observe(time.perf_counter() - conn.info["query_started"].pop())
+
+
+def _handle_error(context):
+    if context.connection is not None and context.connection.info.get("query_started"):
+        context.connection.info["query_started"].pop()
+
+
+def metrics_view():
+    return registry.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
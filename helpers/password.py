@@ -0,0 +1,215 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+
+import bcrypt
+
+from helpers.exceptions import HashingQueueFull
+
+PASSWORD_HASH_WORKERS = 2  # Processes in the pool, 0 hashes inline on the calling thread.
+PASSWORD_HASH_QUEUE_SIZE = 32  # Maximum number of queued plus running hash jobs.
+PASSWORD_HASH_QUEUE_TIMEOUT = 5  # Seconds to wait for a free queue slot before giving up.
+PASSWORD_HASH_BULK_JOBS = 1  # Queued plus running jobs of hash_passwords calls, the rest of the pool is left to logins.
+
+
+def _hash_password(password: bytes) -> tuple:
+    started = time.perf_counter()
+    hashed = bcrypt.hashpw(password, bcrypt.gensalt())
+    return hashed, time.perf_counter() - started
+
+
+def _check_password(password: bytes, hashed: bytes) -> tuple:
+    started = time.perf_counter()
+    valid = bcrypt.checkpw(password, hashed)
+    return valid, time.perf_counter() - started
+
+
+class PasswordHasher(object):
+    """
+    Runs bcrypt hashing and verification in a process pool so the
+    request thread only waits for the result and does not burn CPU
+    while holding the GIL.
+
+    The number of jobs that may be queued or running is bounded by
+    `queue_size`. A caller that cannot get a slot within `queue_timeout`
+    seconds gets a HashingQueueFull exception.
+
+    Bulk hashing (hash_passwords) is further limited to `bulk_jobs`
+    queued or running jobs for all callers together. The pool runs jobs
+    first in, first out, so a login waits behind at most that many bulk
+    hashes instead of behind a whole bulk request.
+    """
+
+    def __init__(
+            self,
+            workers: int = PASSWORD_HASH_WORKERS,
+            queue_size: int = PASSWORD_HASH_QUEUE_SIZE,
+            queue_timeout: float = PASSWORD_HASH_QUEUE_TIMEOUT,
+            bulk_jobs: int = PASSWORD_HASH_BULK_JOBS,
+    ):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.bulk_jobs = bulk_jobs
+        self._pool = None
+        self._pool_pid = None
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._bulk_slots = threading.BoundedSemaphore(bulk_jobs)
+        self._lock = threading.Lock()
+        self._queue_depth = 0
+        self._jobs = 0
+        self._rejected = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._hash_time = 0.0
+        self._max_hash_time = 0.0
+
+    def configure(
+            self,
+            workers: int = None,
+            queue_size: int = None,
+            queue_timeout: float = None,
+            bulk_jobs: int = None,
+    ):
+        self.shutdown()
+        with self._lock:
+            if workers is not None:
+                self.workers = workers
+            if queue_size is not None:
+                self.queue_size = queue_size
+                self._slots = threading.BoundedSemaphore(queue_size)
+            if queue_timeout is not None:
+                self.queue_timeout = queue_timeout
+            if bulk_jobs is not None:
+                self.bulk_jobs = bulk_jobs
+                self._bulk_slots = threading.BoundedSemaphore(bulk_jobs)
+
+    def hash_password(self, password: bytes) -> bytes:
+        """
+        :param password: the plain text password
+        :return: the bcrypt hash of the password with a fresh salt
+        """
+        return self._run(_hash_password, password)
+
+    def hash_passwords(self, passwords: list) -> list:
+        """
+        Hash many passwords, at most `bulk_jobs` at a time over all
+        callers. Each password also takes a queue slot like a single hash
+        does.
+
+        :param passwords: the plain text passwords
+        :return: the bcrypt hashes, in the order of `passwords`
+        """
+        bulk_slots = self._bulk_slots
+        futures = []
+        try:
+            for password in passwords:
+                if not bulk_slots.acquire(timeout=self.queue_timeout):
+                    with self._lock:
+                        self._rejected += 1
+                    raise HashingQueueFull(f"bulk password hashing is busy ({self.bulk_jobs} jobs)")
+                try:
+                    future = self._submit(_hash_password, password)
+                except Exception:
+                    bulk_slots.release()
+                    raise
+                future.add_done_callback(lambda _: bulk_slots.release())
+                futures.append(future)
+        except HashingQueueFull:
+            # Let the jobs that did get a slot finish before giving up.
+            wait(futures)
+            raise
+        return [future.result() for future in futures]
+
+    def check_password(self, password: bytes, hashed: bytes) -> bool:
+        """
+        :param password: the plain text password
+        :param hashed: the stored bcrypt hash
+        :return: True if the password matches the hash
+        """
+        return self._run(_check_password, password, hashed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "queue_depth": self._queue_depth,
+                "jobs": self._jobs,
+                "rejected": self._rejected,
+                "wait_time_seconds": self._wait_time,
+                "wait_time_max": self._max_wait_time,
+                "wait_time_avg": self._wait_time / self._jobs if self._jobs else 0.0,
+                "hash_time_seconds": self._hash_time,
+                "hash_time_max": self._max_hash_time,
+                "hash_time_avg": self._hash_time / self._jobs if self._jobs else 0.0,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            # A forked worker must not reuse the pool of its parent.
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _run(self, fn, *args):
+        return self._submit(fn, *args).result()
+
+    def _submit(self, fn, *args) -> Future:
+        slots = self._slots
+        if not slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self._rejected += 1
+            raise HashingQueueFull(f"password hashing queue is full ({self.queue_size} jobs)")
+
+        with self._lock:
+            self._queue_depth += 1
+
+        submitted = time.perf_counter()
+        try:
+            if self.workers > 0:
+                job = self._get_pool().submit(fn, *args)
+            else:
+                job = Future()
+                job.set_result(fn(*args))
+        except Exception:
+            self._release(slots, submitted, None)
+            raise
+
+        result = Future()
+
+        def done(job):
+            try:
+                value, hash_time = job.result()
+            except Exception as e:
+                self._release(slots, submitted, None)
+                result.set_exception(e)
+            else:
+                self._release(slots, submitted, hash_time)
+                result.set_result(value)
+
+        job.add_done_callback(done)
+        return result
+
+    def _release(self, slots, submitted: float, hash_time):
+        elapsed = time.perf_counter() - submitted
+        with self._lock:
+            self._queue_depth -= 1
+            if hash_time is not None:
+                wait_time = max(elapsed - hash_time, 0.0)
+                self._jobs += 1
+                self._wait_time += wait_time
+                self._max_wait_time = max(self._max_wait_time, wait_time)
+                self._hash_time += hash_time
+                self._max_hash_time = max(self._max_hash_time, hash_time)
+        slots.release()
+
+password_hasher = PasswordHasher()
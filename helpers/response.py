@@ -1,33 +1,69 @@
+from flask.json import JSONEncoder
+
 from helpers.exceptions import InvalidResponse
-from logger import CustomLogger
 
-log = CustomLogger()
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
+VALID_CODES = frozenset(("ok", "error"))
 
-class Response:
-    optional_fields = {}
+JSON_FAST_ENCODER = True  # Serialize responses with orjson when it is installed.
 
-    def __init__(self, code: str, message: str, **kwargs):
 
-        valid_codes = ["ok", "error"]
+class Response:
+    """
+    Result of an API call or of a helper between API calls. `code` is
+    "ok" or "error", any keyword arguments become extra fields of the
+    JSON response.
+    """
+
+    __slots__ = ("code", "message", "optional_fields")
 
-        if code not in valid_codes:
-            raise InvalidResponse(f"Error code should be one of: {', '.join(valid_codes)}")
+    def __init__(self, code: str, message: str, **kwargs):
+        if code not in VALID_CODES:
+            raise InvalidResponse(f"Error code should be one of: {', '.join(sorted(VALID_CODES))}")
 
         self.code = code
         self.message = message
+        # kwargs is a new dict on every call, it is owned by this instance.
+        self.optional_fields = kwargs
+
+    def to_json(self) -> dict:
+        return {"code": self.code, "message": self.message, **self.optional_fields}
+
+    def __repr__(self):
+        return f"Response({self.code!r}, {self.message!r}, **{self.optional_fields!r})"
+
+
+class FastJSONEncoder(JSONEncoder):
+    """
+    JSON encoder for app.json_encoder that serializes with orjson, which
+    is several times faster than the json module. Falls back to the
+    regular encoder for pretty printing, which orjson does not support
+    in the same format, and when orjson is not installed.
+    """
 
-        if len(list({**kwargs})) > 0:
-            self.optional_fields = {**kwargs}
+    def encode(self, o) -> str:
+        if orjson is None or self.indent is not None:
+            return super().encode(o)
 
-    def to_json(self):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(o, default=self.default, option=option).decode()
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bit, leave those to the json module.
+            return super().encode(o)
 
-        mandatory_fields = {
-            "code": self.code,
-            "message": self.message
-        }
 
-        if len(list({**self.optional_fields})) > 0:
-            return {**mandatory_fields, **self.optional_fields}
-        else:
-            return mandatory_fields
+def json_encoder(fast: bool = JSON_FAST_ENCODER) -> type:
+    """
+    :param fast: use orjson if it is installed
+    :return: the encoder class to set as app.json_encoder
+    """
+    if fast and orjson is not None:
+        return FastJSONEncoder
+    return JSONEncoder
@@ -0,0 +1,174 @@
+import secrets
+import threading
+import time
+from datetime import datetime
+from typing import Union
+
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from database import db_session_manager
+from logger import CustomLogger
+from models.api import Account, RevokedToken
+
+log = CustomLogger()
+
+TOKEN_SIGNED = False  # Hand out signed tokens at login instead of storing a token per account.
+TOKEN_DENYLIST_REFRESH_INTERVAL = 10  # Seconds between reloads of the revoked token list.
+TOKEN_SIGNING_SALT = "api-token"  # Separates token signatures from other uses of the signing keys.
+
+
+class SignedTokens(object):
+    """
+    Stateless api keys: an HMAC signed payload with the account id, account
+    code, uid, login code, admin level and expiry, so a key is verified
+    without a database lookup. Signed keys contain a "." and opaque keys
+    from generate_api_token never do, so both kinds work side by side.
+
+    Revoked keys are kept in the revoked_token table. Every process holds
+    the list in memory and reloads it every `refresh_interval` seconds, a
+    key revoked by another process is accepted until then.
+
+    `secret_keys` may hold several keys to rotate them: tokens are signed
+    with the last key and verified against all of them.
+    """
+
+    def __init__(self, enabled: bool = TOKEN_SIGNED, refresh_interval: float = TOKEN_DENYLIST_REFRESH_INTERVAL):
+        self.enabled = enabled
+        self.refresh_interval = refresh_interval
+        self.issued = 0
+        self.verified = 0
+        self.rejected = 0
+        self._serializer = None
+        self._denied = frozenset()
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+
+    def configure(self, enabled: bool = None, secret_keys: list = None, refresh_interval: float = None):
+        if enabled is not None:
+            self.enabled = enabled
+        if refresh_interval is not None:
+            self.refresh_interval = refresh_interval
+        if secret_keys:
+            self._serializer = URLSafeSerializer(secret_keys, salt=TOKEN_SIGNING_SALT)
+        if self.enabled and self._serializer is None:
+            raise RuntimeError("Signed tokens need a signing key, set TOKEN_SIGNING_KEYS")
+
+    @staticmethod
+    def is_signed(key: str) -> bool:
+        return "." in key
+
+    def issue(self, account: Account, valid_until: datetime) -> str:
+        """
+        :param account: the account the token is for
+        :param valid_until: moment the token expires
+        :return: the signed api key
+        """
+        self.issued += 1
+        return self._serializer.dumps({
+            "id": account.id,
+            "ac": account.code,
+            "uid": account.uid,
+            "lc": account.login_code,
+            "al": account.admin_level,
+            "exp": int(valid_until.timestamp()),
+            "jti": secrets.token_hex(8),
+        })
+
+    def verify(self, account_code: str, key: str) -> Union[dict, None]:
+        """
+        :param account_code: account code of the requester
+        :param key: the signed api key of the requester
+        :return: the account info (uid, login_code, admin_level), or None
+            if the key is forged, expired, revoked or for another account code
+        """
+        payload = self._load(key)
+        if (
+                payload is None
+                or payload.get("ac") != account_code
+                or payload.get("exp", 0) <= time.time()
+                or payload.get("jti") in self._denylist()
+        ):
+            self.rejected += 1
+            return None
+
+        self.verified += 1
+        return {
+            "uid": payload["uid"],
+            "login_code": payload["lc"],
+            "admin_level": payload["al"],
+        }
+
+    def revoke(self, account_code: str, key: str) -> bool:
+        """
+        Put a signed key on the deny-list until it expires. Revoking a
+        key that is already revoked succeeds without a write.
+
+        :return: False if the key is not a valid key for `account_code`
+        """
+        payload = self._load(key)
+        if payload is None or payload.get("ac") != account_code:
+            return False
+        if payload["jti"] in self._denied:
+            return True
+
+        with db_session_manager() as s:
+            try:
+                s.execute(
+                    insert(RevokedToken).values(
+                        jti=payload["jti"],
+                        valid_until=datetime.fromtimestamp(payload["exp"]),
+                    )
+                )
+                s.commit()
+            except IntegrityError:
+                # Revoked before, by this or another process.
+                s.rollback()
+
+        with self._lock:
+            self._denied = self._denied | {payload["jti"]}
+        return True
+
+    def refresh(self):
+        """Reload the deny-list from the database."""
+        with db_session_manager(read_only=True) as s:
+            denied = frozenset(s.execute(
+                select(RevokedToken.jti).where(RevokedToken.valid_until >= datetime.now())
+            ).scalars())
+
+        with self._lock:
+            self._denied = denied
+            self._refreshed_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "issued": self.issued,
+            "verified": self.verified,
+            "rejected": self.rejected,
+            "denylist_size": len(self._denied),
+        }
+
+    def _load(self, key: str) -> Union[dict, None]:
+        if self._serializer is None:
+            return None
+        try:
+            payload = self._serializer.loads(key)
+        except BadSignature:
+            return None
+        return payload if isinstance(payload, dict) else None
+
+    def _denylist(self) -> frozenset:
+        refreshed_at = self._refreshed_at
+        if refreshed_at is None or time.monotonic() - refreshed_at >= self.refresh_interval:
+            try:
+                self.refresh()
+            except Exception as e:
+                # Keep the last known list, and try again after the next interval.
+                self._refreshed_at = time.monotonic()
+                log.fail(f"Could not refresh the revoked token list: {str(e)}")
+        return self._denied
+
+
+signed_tokens = SignedTokens()
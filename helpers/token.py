@@ -1,10 +1,13 @@
 import hashlib
 import random
+import re
 import string
 
 from database import db_session_manager
 from models.api import Account, Token
 
+API_TOKEN_PATTERN = re.compile(r"[0-9a-f]{64}")  # What generate_api_token returns, a sha256 hex digest.
+
 
 def get_token_by_login_code(login_code):
     with db_session_manager() as session:
@@ -15,3 +18,12 @@ def generate_api_token() -> str:
     random_bytes = "".join(random.choices(string.ascii_letters + string.digits, k=20)).encode()
     api_key = hashlib.sha256(random_bytes).hexdigest()
     return api_key
+
+
+def is_api_token(key) -> bool:
+    """
+    :return: True if `key` looks like a key from generate_api_token. Check
+        this before a client's key is used in a query, Token.key only
+        binds valid hex.
+    """
+    return isinstance(key, str) and API_TOKEN_PATTERN.fullmatch(key) is not None
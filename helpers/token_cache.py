@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Union
+
+TOKEN_CACHE_SIZE = 10000  # Maximum number of (account_code, key) pairs kept in memory.
+TOKEN_CACHE_TTL = 30  # Seconds a validated token is trusted without asking the database.
+
+
+class TokenCache(object):
+    """
+    Bounded in-process cache for validated api keys.
+
+    Entries are keyed on (account_code, key) and hold the account info
+    (uid, login_code, admin_level) that belongs to the token. An entry
+    expires after `ttl` seconds or when the token's valid_until passes,
+    whichever comes first. When the cache is full the least recently
+    used entry is evicted.
+    """
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._cache_keys_by_key = {}
+        self._lock = threading.Lock()
+
+    def configure(self, max_size: int = None, ttl: float = None):
+        with self._lock:
+            if max_size is not None:
+                self.max_size = max_size
+            if ttl is not None:
+                self.ttl = ttl
+            while len(self._entries) > self.max_size:
+                self._evict_oldest()
+
+    def get(self, account_code: str, key: str) -> Union[dict, None]:
+        """
+        :param account_code: account code of the requester
+        :param key: the api_key of the requester
+        :return: a copy of the cached account info or None on a miss
+        """
+        cache_key = (account_code, key)
+
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, account_info = entry
+            if expires_at <= time.monotonic():
+                self._remove(cache_key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(cache_key)
+            self.hits += 1
+            return dict(account_info)
+
+    def put(self, account_code: str, key: str, account_info: dict, valid_until: datetime = None):
+        """
+        Store the account info for a validated token.
+
+        :param account_code: account code of the requester
+        :param key: the api_key of the requester
+        :param account_info: dict with uid, login_code and admin_level
+        :param valid_until: Token.valid_until, the entry never outlives it
+        :return: Nothing
+        """
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+
+        lifetime = self.ttl
+        if valid_until is not None:
+            lifetime = min(lifetime, (valid_until - datetime.now()).total_seconds())
+            if lifetime <= 0:
+                return
+
+        cache_key = (account_code, key)
+
+        with self._lock:
+            if cache_key in self._entries:
+                self._entries.move_to_end(cache_key)
+            self._entries[cache_key] = (time.monotonic() + lifetime, dict(account_info))
+            self._cache_keys_by_key.setdefault(key, set()).add(cache_key)
+
+            while len(self._entries) > self.max_size:
+                self._evict_oldest()
+
+    def invalidate(self, key: str):
+        """
+        Drop every entry for the given api key, regardless of account code.
+        Call this whenever a token is changed or deleted.
+        """
+        with self._lock:
+            for cache_key in self._cache_keys_by_key.pop(key, ()):
+                self._entries.pop(cache_key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._cache_keys_by_key.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _evict_oldest(self):
+        cache_key, _ = self._entries.popitem(last=False)
+        self._forget_cache_key(cache_key)
+        self.evictions += 1
+
+    def _remove(self, cache_key: tuple):
+        del self._entries[cache_key]
+        self._forget_cache_key(cache_key)
+
+    def _forget_cache_key(self, cache_key: tuple):
+        cache_keys = self._cache_keys_by_key.get(cache_key[1])
+        if cache_keys is not None:
+            cache_keys.discard(cache_key)
+            if not cache_keys:
+                del self._cache_keys_by_key[cache_key[1]]
+
+
+token_cache = TokenCache()
@@ -0,0 +1,202 @@
+import atexit
+import threading
+from datetime import datetime, timedelta
+from typing import Union
+
+from sqlalchemy import bindparam, update
+
+from database import db_session_manager
+from logger import CustomLogger
+from models.api import Token
+
+log = CustomLogger()
+
+TOKEN_SLIDING_EXPIRATION = False  # Extend tokens to now + lifetime instead of adding the lifetime to valid_until.
+TOKEN_EXTEND_THRESHOLD = 3600  # Sliding mode: skip the write unless it moves valid_until by this many seconds.
+TOKEN_EXTEND_BUFFERED = False  # Sliding mode: collect extensions and write them in one batched UPDATE.
+TOKEN_EXTEND_FLUSH_INTERVAL = 5  # Seconds between flushes of buffered extensions.
+
+
+class TokenLifetime(object):
+    """
+    Decides when a token's valid_until is written on login.
+
+    In the default mode every extension adds the lifetime to the stored
+    valid_until and is written immediately. In sliding mode the new
+    expiry is now + lifetime, and the write is skipped when it would move
+    the expiry by less than `threshold` seconds. With `buffered` on,
+    sliding extensions are kept in memory and written every
+    `flush_interval` seconds in one UPDATE; effective_valid_until()
+    includes the pending value so reads see the correct expiry.
+    """
+
+    def __init__(
+            self,
+            lifetime: timedelta,
+            sliding: bool = TOKEN_SLIDING_EXPIRATION,
+            threshold: float = TOKEN_EXTEND_THRESHOLD,
+            buffered: bool = TOKEN_EXTEND_BUFFERED,
+            flush_interval: float = TOKEN_EXTEND_FLUSH_INTERVAL,
+    ):
+        self.lifetime = lifetime
+        self.sliding = sliding
+        self.threshold = threshold
+        self.buffered = buffered
+        self.flush_interval = flush_interval
+        self.skipped = 0
+        self.flushed = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+        self._atexit_registered = False
+
+    def configure(
+            self,
+            sliding: bool = None,
+            threshold: float = None,
+            buffered: bool = None,
+            flush_interval: float = None,
+    ):
+        if sliding is not None:
+            self.sliding = sliding
+        if threshold is not None:
+            self.threshold = threshold
+        if buffered is not None:
+            self.buffered = buffered
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+
+        if self.sliding and self.buffered:
+            self._start()
+        else:
+            self._stop()
+            self.flush()
+
+    def effective_valid_until(self, token_id: int, valid_until: datetime) -> datetime:
+        """
+        :param token_id: Token.id
+        :param valid_until: Token.valid_until as stored in the database
+        :return: the stored expiry, or the pending extension if that is later
+        """
+        pending = self._pending.get(token_id)
+        if pending is not None and (valid_until is None or pending > valid_until):
+            return pending
+        return valid_until
+
+    def extended_valid_until(self, token_id: int, valid_until: datetime) -> Union[datetime, None]:
+        """
+        :param token_id: Token.id
+        :param valid_until: Token.valid_until as stored in the database
+        :return: the new valid_until to write, or None if no write is needed
+        """
+        if not self.sliding:
+            return valid_until + self.lifetime
+
+        new_valid_until = datetime.now() + self.lifetime
+        current = self.effective_valid_until(token_id, valid_until)
+        if current is not None and (new_valid_until - current).total_seconds() < self.threshold:
+            self.skipped += 1
+            return None
+
+        return new_valid_until
+
+    def defer(self, token_id: int, valid_until: datetime) -> bool:
+        """
+        Buffer the extension if buffering is on.
+
+        :return: True if the extension will be written by flush(), False if the caller must write it
+        """
+        if not (self.sliding and self.buffered):
+            return False
+
+        with self._lock:
+            pending = self._pending.get(token_id)
+            if pending is None or valid_until > pending:
+                self._pending[token_id] = valid_until
+        return True
+
+    def flush(self) -> int:
+        """
+        Write all buffered extensions with one batched UPDATE.
+        An extension never moves valid_until backwards.
+
+        :return: number of extensions written
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if not pending:
+            return 0
+
+        params = [
+            {"token_id": token_id, "new_valid_until": valid_until}
+            for token_id, valid_until in pending.items()
+        ]
+
+        try:
+            with db_session_manager() as s:
+                s.execute(
+                    update(
+                        Token
+                    ).where(
+                        Token.id == bindparam("token_id")
+                    ).where(
+                        Token.valid_until < bindparam("new_valid_until")
+                    ).values(
+                        valid_until=bindparam("new_valid_until")
+                    ).execution_options(
+                        synchronize_session=False
+                    ),
+                    params,
+                )
+                s.commit()
+        except Exception as e:
+            # Put them back unless a newer extension arrived meanwhile.
+            with self._lock:
+                for token_id, valid_until in pending.items():
+                    if token_id not in self._pending or self._pending[token_id] < valid_until:
+                        self._pending[token_id] = valid_until
+            log.fail(f"Could not write {len(pending)} token extension(s): {str(e)}")
+            return 0
+
+        self.flushed += len(pending)
+        return len(pending)
+
+    def stop(self):
+        """
+        Stop the flush thread and write what is buffered. configure()
+        starts the thread again.
+        """
+        self._stop()
+        self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "sliding": self.sliding,
+            "buffered": self.buffered,
+            "pending": len(self._pending),
+            "skipped": self.skipped,
+            "flushed": self.flushed,
+        }
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="token-extension-flush", daemon=True)
+        self._thread.start()
+        if not self._atexit_registered:
+            atexit.register(self.flush)
+            self._atexit_registered = True
+
+    def _stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
@@ -0,0 +1,144 @@
+import threading
+import time
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, select
+
+from database import db_session_manager
+from endpoints.auth import expired_token_cutoff, token_lifetime
+from logger import CustomLogger
+from models.api import RevokedToken, Token
+
+log = CustomLogger()
+
+TOKEN_REAPER_INTERVAL = 300  # Seconds between in-process reaper runs, 0 disables the reaper thread.
+TOKEN_REAPER_BATCH_SIZE = 1000  # Maximum number of tokens deleted per statement.
+
+
+def reap_expired_tokens(batch_size: int = TOKEN_REAPER_BATCH_SIZE, max_batches: int = None) -> dict:
+    """
+    Delete expired tokens in batches of at most `batch_size` rows, each
+    batch in its own transaction so locks are held briefly. Expired
+    tokens are never in the token cache, so nothing needs invalidating.
+    Deny-list entries of signed tokens that have expired are deleted too.
+
+    :param batch_size: maximum number of tokens deleted per statement
+    :param max_batches: stop after this many batches, None runs until no expired tokens are left
+    :return: dict with deleted, batches, elapsed (seconds), rate (tokens/second), backlog
+        and revocations_deleted
+    """
+    # Buffered extensions may move tokens out of the expired range.
+    token_lifetime.flush()
+
+    cutoff = expired_token_cutoff()
+    started = time.perf_counter()
+    deleted = 0
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        expired_ids = select(
+            Token.id
+        ).where(
+            Token.valid_until < cutoff
+        ).limit(
+            batch_size
+        ).scalar_subquery()
+
+        with db_session_manager() as s:
+            result = s.execute(
+                delete(Token).where(Token.id.in_(expired_ids)).execution_options(synchronize_session=False)
+            )
+            s.commit()
+
+        deleted += result.rowcount
+        batches += 1
+
+        if result.rowcount < batch_size:
+            break
+
+    # Revoked signed tokens only need to be denied until they expire.
+    with db_session_manager() as s:
+        result = s.execute(
+            delete(RevokedToken).where(RevokedToken.valid_until < datetime.now())
+        )
+        s.commit()
+    revocations_deleted = result.rowcount
+
+    with db_session_manager() as s:
+        backlog = s.execute(select(func.count(Token.id)).where(Token.valid_until < cutoff)).scalar()
+
+    elapsed = time.perf_counter() - started
+
+    return {
+        "deleted": deleted,
+        "batches": batches,
+        "elapsed": elapsed,
+        "rate": deleted / elapsed if elapsed > 0 else 0.0,
+        "backlog": backlog,
+        "revocations_deleted": revocations_deleted,
+    }
+
+
+class TokenReaper(object):
+    """
+    Runs reap_expired_tokens every `interval` seconds on a daemon thread.
+    The statistics of the last run are kept in `last_run`.
+    """
+
+    def __init__(self, interval: float = TOKEN_REAPER_INTERVAL, batch_size: int = TOKEN_REAPER_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.last_run = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self, interval: float = None, batch_size: int = None):
+        if interval is not None:
+            self.interval = interval
+        if batch_size is not None:
+            self.batch_size = batch_size
+
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="token-reaper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                stats = reap_expired_tokens(batch_size=self.batch_size)
+            except Exception as e:
+                log.fail(f"Token reaper failed: {str(e)}")
+                continue
+
+            self.last_run = {"finished": datetime.now(), **stats}
+            log.info(
+                f"Token reaper deleted {stats['deleted']} token(s) in {stats['batches']} batch(es), "
+                f"{stats['rate']:.0f} tokens/s, backlog {stats['backlog']}"
+            )
+
+
+token_reaper = TokenReaper()
+
+
+@click.command("reap-tokens")
+@click.option("--batch-size", default=TOKEN_REAPER_BATCH_SIZE, show_default=True, help="Tokens deleted per batch.")
+@click.option("--max-batches", default=None, type=int, help="Stop after this many batches.")
+@with_appcontext
+def reap_tokens_command(batch_size: int, max_batches: int):
+    """Delete expired tokens from the database."""
+    stats = reap_expired_tokens(batch_size=batch_size, max_batches=max_batches)
+    click.echo(
+        f"Deleted {stats['deleted']} token(s) in {stats['batches']} batch(es) "
+        f"in {stats['elapsed']:.2f}s ({stats['rate']:.0f} tokens/s), backlog {stats['backlog']}"
+    )
@@ -1,13 +1,20 @@
 import os
+from importlib import import_module
 
 from flask import Flask
 from flask_cors import CORS
 from flask_jsonrpc import JSONRPC
-from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
 
-from endpoints.account import account
-from endpoints.auth import auth
+# Blueprints are imported by create_app, importing this module stays cheap.
+BLUEPRINTS = [
+    "endpoints.auth:auth",
+    "endpoints.account:account",
+]
+
+
+def load_blueprint(path: str):
+    module_name, attribute = path.split(":")
+    return getattr(import_module(module_name), attribute)
 
 
 def create_app():
@@ -15,12 +22,140 @@ def create_app():
     CORS(app)
     app.config.from_object(os.environ.get("APP_SETTINGS"))
     api = JSONRPC(app, "/api/v1", enable_web_browsable_api=True)
-    db = SQLAlchemy(app)
-    migrate = Migrate(app, db)
-    endpoints = [
-        auth,
-        account,
-    ]
+
+    import database
+    from endpoints.auth import token_lifetime
+    from helpers.account_cache import account_cache
+    from helpers.admission import admission
+    from helpers.metrics import export_stats, instrument_engine, metrics_view, registry
+    from helpers.password import password_hasher
+    from helpers.response import json_encoder
+    from helpers.signed_token import signed_tokens
+    from helpers.token_cache import token_cache
+    from helpers.token_reaper import reap_tokens_command, token_reaper
+    from logger import CustomLogger
+
+    CustomLogger().writer.configure(
+        queue_size=app.config.get("LOG_QUEUE_SIZE"),
+        policy=app.config.get("LOG_QUEUE_POLICY"),
+        flush_interval=app.config.get("LOG_FLUSH_INTERVAL"),
+        flush_size=app.config.get("LOG_FLUSH_SIZE"),
+        db_batch_size=app.config.get("LOG_DB_BATCH_SIZE"),
+    )
+    CustomLogger().limiter.configure(
+        sample_rates=app.config.get("LOG_SAMPLE_RATES"),
+        deduplicate_window=app.config.get("LOG_DEDUPLICATE_WINDOW"),
+        rate_limit=app.config.get("LOG_RATE_LIMIT"),
+    )
+    app.json_encoder = json_encoder(app.config.get("JSON_FAST_ENCODER", True))
+    database.configure_engine(
+        url=app.config.get("SQLALCHEMY_DATABASE_URI"),
+        pool_size=app.config.get("DATABASE_POOL_SIZE"),
+        max_overflow=app.config.get("DATABASE_MAX_OVERFLOW"),
+        pool_recycle=app.config.get("DATABASE_POOL_RECYCLE"),
+        pool_pre_ping=app.config.get("DATABASE_POOL_PRE_PING"),
+        pool_timeout=app.config.get("DATABASE_POOL_TIMEOUT"),
+        replica_urls=app.config.get("DATABASE_REPLICA_URLS"),
+        replica_balancing=app.config.get("DATABASE_REPLICA_BALANCING"),
+    )
+    if app.config.get("DATABASE_REQUEST_SESSION", True):
+        database.init_request_sessions(app)
+    if app.config.get("DATABASE_CREATE_ALL"):
+        database.on_engine_created(database.create_all)
+    db = database.SharedEngineSQLAlchemy(app)
+    if app.config.get("MIGRATIONS_ENABLED", True):
+        # Flask-Migrate pulls in alembic, only load it where `flask db` is wanted.
+        from flask_migrate import Migrate
+
+        migrate = Migrate(app, db)
+    token_cache.configure(
+        max_size=app.config.get("TOKEN_CACHE_SIZE"),
+        ttl=app.config.get("TOKEN_CACHE_TTL"),
+    )
+    account_cache.configure(
+        max_size=app.config.get("ACCOUNT_CACHE_SIZE"),
+        ttl=app.config.get("ACCOUNT_CACHE_TTL"),
+        negative_max_size=app.config.get("ACCOUNT_CACHE_NEGATIVE_SIZE"),
+        negative_ttl=app.config.get("ACCOUNT_CACHE_NEGATIVE_TTL"),
+    )
+    password_hasher.configure(
+        workers=app.config.get("PASSWORD_HASH_WORKERS"),
+        queue_size=app.config.get("PASSWORD_HASH_QUEUE_SIZE"),
+        queue_timeout=app.config.get("PASSWORD_HASH_QUEUE_TIMEOUT"),
+        bulk_jobs=app.config.get("PASSWORD_HASH_BULK_JOBS"),
+    )
+    token_lifetime.configure(
+        sliding=app.config.get("TOKEN_SLIDING_EXPIRATION"),
+        threshold=app.config.get("TOKEN_EXTEND_THRESHOLD"),
+        buffered=app.config.get("TOKEN_EXTEND_BUFFERED"),
+        flush_interval=app.config.get("TOKEN_EXTEND_FLUSH_INTERVAL"),
+    )
+    admission.configure(
+        enabled=app.config.get("ADMISSION_ENABLED"),
+        concurrency=app.config.get("ADMISSION_CONCURRENCY"),
+        rate_limited_methods=app.config.get("ADMISSION_RATE_LIMITED_METHODS"),
+        account_rate=app.config.get("ADMISSION_ACCOUNT_RATE"),
+        account_burst=app.config.get("ADMISSION_ACCOUNT_BURST"),
+        login_rate=app.config.get("ADMISSION_LOGIN_RATE"),
+        login_burst=app.config.get("ADMISSION_LOGIN_BURST"),
+        max_buckets=app.config.get("ADMISSION_MAX_BUCKETS"),
+    )
+    signed_tokens.configure(
+        enabled=app.config.get("TOKEN_SIGNED"),
+        secret_keys=app.config.get("TOKEN_SIGNING_KEYS"),
+        refresh_interval=app.config.get("TOKEN_DENYLIST_REFRESH_INTERVAL"),
+    )
+    token_reaper.start(
+        interval=app.config.get("TOKEN_REAPER_INTERVAL"),
+        batch_size=app.config.get("TOKEN_REAPER_BATCH_SIZE"),
+    )
+    app.cli.add_command(reap_tokens_command)
+    if app.config.get("METRICS_ENABLED"):
+        registry.configure(
+            directory=app.config.get("METRICS_DIR"),
+            flush_interval=app.config.get("METRICS_FLUSH_INTERVAL"),
+        )
+        database.on_engine_created(instrument_engine)
+        export_stats(
+            "token_cache", token_cache.stats,
+            counters={
+                "hits": "Token validations answered from the token cache.",
+                "misses": "Token validations not found in the token cache.",
+                "evictions": "Entries evicted from the full token cache.",
+            },
+            gauges={"size": "Entries in the token cache."},
+        )
+        export_stats(
+            "account_cache", account_cache.stats,
+            counters={
+                "hits": "Account lookups answered from the account cache.",
+                "negative_hits": "Lookups of unknown accounts answered from the account cache.",
+                "misses": "Account lookups not found in the account cache.",
+                "evictions": "Entries evicted from the full account cache.",
+            },
+            gauges={
+                "size": "Accounts in the account cache.",
+                "negative_size": "Unknown (account code, login code) pairs in the account cache.",
+            },
+        )
+        export_stats(
+            "password_hash", password_hasher.stats,
+            counters={
+                "jobs": "Password hash and check jobs finished.",
+                "rejected": "Password hash jobs rejected because the queue was full.",
+                "wait_time_seconds": "Time finished jobs spent queued before a hashing worker took them.",
+                "hash_time_seconds": "Time finished jobs spent hashing.",
+            },
+            gauges={
+                "queue_depth": "Password hash jobs queued or running.",
+                "queue_size": "Maximum number of password hash jobs queued or running.",
+                "workers": "Password hashing processes.",
+            },
+        )
+        app.add_url_rule("/metrics", "metrics", view_func=metrics_view)
+    if app.config.get("DATABASE_POOL_WARMUP"):
+        database.warm_up_pool(app.config.get("DATABASE_POOL_WARMUP"))
+    endpoints = [load_blueprint(path) for path in BLUEPRINTS]
 
     for ep in endpoints:
         api.register_blueprint(
@@ -28,3 +163,52 @@ def create_app():
         )
 
     return app
+
+
+def before_fork():
+    """
+    Run in the master before a preloaded app is forked into workers:
+    stop the token reaper, the token extension flush and the metrics
+    writer threads, write out queued log lines, stop the hashing pool
+    and close the pooled connections, e.g. those opened by
+    DATABASE_POOL_WARMUP. No query, half written buffer, pool process or
+    socket is then copied into the workers, and the master does no
+    background work of its own. after_fork starts the threads and warms
+    up the pool in each worker.
+    """
+    import database
+    from endpoints.auth import token_lifetime
+    from helpers.metrics import registry
+    from helpers.password import password_hasher
+    from helpers.token_reaper import token_reaper
+    from logger import CustomLogger
+
+    token_reaper.stop()
+    token_lifetime.stop()
+    registry.close()
+    CustomLogger().shutdown()
+    password_hasher.shutdown()
+    database.dispose_engine()
+
+
+def after_fork(app):
+    """
+    Run in every worker forked from a preloaded app. Pooled connections
+    and background threads of the master must not be shared, so the
+    engine's pool is emptied, the logger gets a fresh writer and the
+    background threads are started again for this process.
+    """
+    import database
+    from endpoints.auth import token_lifetime
+    from helpers.metrics import registry
+    from helpers.token_reaper import token_reaper
+    from logger import CustomLogger
+
+    database.dispose_engine()
+    CustomLogger().after_fork()
+    token_lifetime.configure()
+    token_reaper.start()
+    if app.config.get("METRICS_ENABLED"):
+        registry.configure()
+    if app.config.get("DATABASE_POOL_WARMUP"):
+        database.warm_up_pool(app.config.get("DATABASE_POOL_WARMUP"))
@@ -1,8 +1,13 @@
+import atexit
 import datetime
-import inspect
 import os
+import queue
+import random
+import sys
+import threading
+import time
 
-from flask import g
+from flask.globals import _app_ctx_stack
 
 
 class ColorTypes(object):
@@ -25,6 +30,16 @@ log_level_definitions = {
     "SILENT": 1,
 }
 
+# Minimum log_level_definitions value at which a level is written, and its color.
+level_definitions = {
+    "DEBUG": (6, ColorTypes.BOLD),
+    "HEADER": (5, ColorTypes.HEADER),
+    "INFO": (5, ColorTypes.INFOBLUE),
+    "OK": (4, ColorTypes.OKGREEN),
+    "WARNING": (3, ColorTypes.WARNING),
+    "FAIL": (2, ColorTypes.FAIL),
+}
+
 ENVIRONMENT = os.environ.get("APP_SETTINGS", "config.Development")
 ENVIRONMENT = "config.Development"
 
@@ -46,6 +61,16 @@ elif ENVIRONMENT == "config.Production":
     LOG_TO_DATABASE = False
     LOG_LEVEL = "WARNING"
 
+LOG_FILE = os.environ.get("LOGFILE", "./ticketmatrix.log")
+LOG_QUEUE_SIZE = 10000  # Maximum number of log lines waiting for the background writer.
+LOG_QUEUE_POLICY = "drop"  # "drop" discards new lines when the queue is full, "block" waits for room.
+LOG_FLUSH_INTERVAL = 1.0  # Seconds between flushes of the logfile and the database batch.
+LOG_FLUSH_SIZE = 64 * 1024  # Flush the logfile when this many bytes are buffered.
+LOG_DB_BATCH_SIZE = 500  # Insert database log rows in batches of this size.
+LOG_SAMPLE_RATES = {}  # Share of calls logged, by "module.function:LEVEL", "module.function" or "LEVEL".
+LOG_DEDUPLICATE_WINDOW = 0  # Seconds a call site's repeated identical message is counted instead of logged. 0 is off.
+LOG_RATE_LIMIT = 0  # Lines per second logged from one call site, the rest are counted. 0 is no limit.
+
 
 class Singleton(type):
     _instances = {}
@@ -56,222 +81,508 @@ class Singleton(type):
         return cls._instances[cls]
 
 
-class CustomLogger(object, metaclass=Singleton):
+class LogRecord(object):
+    """
+    A single log call. Only the timestamp, user and the caller's code
+    object are captured on the calling thread; converting the message
+    to text, truncating it and formatting the screen line happen when
+    a sink asks for them.
+    """
+
+    __slots__ = (
+        "level",
+        "timestamp",
+        "user",
+        "kwargs",
+        "to_screen",
+        "to_file",
+        "to_database",
+        "_message",
+        "_code",
+        "_function",
+        "_max_length",
+        "_text",
+    )
+
     def __init__(
             self,
-            log_level=LOG_LEVEL,
-            log_to_screen=LOG_TO_SCREEN,
-            log_to_database=LOG_TO_DATABASE,
-            log_to_file=LOG_TO_FILE,
+            level,
+            message,
+            timestamp,
+            user=None,
+            code=None,
+            function=None,
+            kwargs=None,
             max_length=60000,
+            to_screen=False,
+            to_file=False,
+            to_database=False,
     ):
-        self.log_level = log_level
-        self.log_to_screen = log_to_screen
-        self.log_to_file = log_to_file
-        self.log_to_database = log_to_database
-        self.max_length = max_length
-
-    def debug(self, message: any, timestamp: datetime.datetime = None, **kwargs):
-
-        if log_level_definitions[self.log_level] < 6:
-            return
-
-        message = str(message)
-        if len(message) > self.max_length:
-            message = (
-                    message[0: int(self.max_length / 2)]
-                    + " { ... ... ... truncated ... ... ... } "
-                    + message[int(-1 * (self.max_length / 2)):]
-            )
-
-        if timestamp is None:
-            timestamp = datetime.datetime.now()
-
-        stack_info = inspect.stack()[1][3]
-
-        formatted_message = (
-                ColorTypes.BOLD
-                + f"[{str(timestamp)}]"
+        self.level = level
+        self.timestamp = timestamp
+        self.user = user
+        self.kwargs = kwargs if kwargs is not None else {}
+        self.to_screen = to_screen
+        self.to_file = to_file
+        self.to_database = to_database
+        self._message = message
+        self._code = code
+        self._function = function
+        self._max_length = max_length
+        self._text = None
+
+    @property
+    def function(self) -> str:
+        if self._function is None:
+            self._function = self._code.co_name if self._code is not None else "-"
+        return self._function
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            message = str(self._message)
+            if len(message) > self._max_length:
+                message = (
+                        message[0: int(self._max_length / 2)]
+                        + " { ... ... ... truncated ... ... ... } "
+                        + message[int(-1 * (self._max_length / 2)):]
+                )
+            self._text = message
+        return self._text
+
+    @property
+    def formatted(self) -> str:
+        return (
+                level_definitions[self.level][1]
+                + f"[{str(self.timestamp)}]"
                 + " "
-                + f"[{g.get('email', '- not logged in -')}]"
+                + f"[{self.user}]"
                 + " "
-                + f"[{stack_info}]"
+                + f"[{self.function}]"
                 + " "
-                + str(message)
+                + self.text
                 + ColorTypes.ENDC
         )
 
-        self.do_logging(
-            formatted_message=formatted_message,
-            timestamp=timestamp,
-            log_level="DEBUG",
-            stack_info=stack_info,
-            message=message,
-            user=g.get("email", "- not logged in -"),
-            **kwargs,
-        )
-
-    def header(self, message: str, timestamp: datetime.datetime = None, **kwargs):
+    def database_row(self) -> dict:
+        return {
+            "timestamp": self.timestamp,
+            "level": str(self.level),
+            "function": str(self.function),
+            "message": self.text,
+            "user": str(self.user),
+        }
 
-        if log_level_definitions[self.log_level] < 5:
-            return
 
-        message = str(message)
-        if len(message) > self.max_length:
-            message = (
-                    message[0: int(self.max_length / 2)]
-                    + " { ... ... ... truncated ... ... ... } "
-                    + message[int(-1 * (self.max_length / 2)):]
-            )
-        if timestamp is None:
-            timestamp = datetime.datetime.now()
+class LogWriter(object):
+    """
+    Background writer for the screen, logfile and database sinks.
 
-        stack_info = inspect.stack()[1][3]
+    Log calls put a LogRecord on a bounded queue and return immediately.
+    A daemon thread drains the queue, keeps the logfile open with a
+    buffer that is flushed on size or time, and inserts database rows
+    in batches. close() drains the queue and flushes everything, it is
+    registered with atexit once, when the thread first starts.
+    """
 
-        formatted_message = (
-                ColorTypes.HEADER
-                + f"[{str(timestamp)}]"
-                + " "
-                + f"[{g.get('email', '- not logged in -')}]"
-                + " "
-                + f"[{stack_info}]"
-                + " "
-                + str(message)
-                + ColorTypes.ENDC
-        )
+    _stop = object()
 
-        self.do_logging(
-            formatted_message=formatted_message,
-            timestamp=timestamp,
-            log_level="HEADER",
-            stack_info=stack_info,
-            message=message,
-            user=g.get("email", "- not logged in -"),
-            **kwargs,
-        )
-
-    def info(
+    def __init__(
             self,
-            message: str,
-            timestamp: datetime.datetime = None,
-            **kwargs: object,
-    ) -> object:
-        if log_level_definitions[self.log_level] < 5:
+            log_file=LOG_FILE,
+            queue_size=LOG_QUEUE_SIZE,
+            policy=LOG_QUEUE_POLICY,
+            flush_interval=LOG_FLUSH_INTERVAL,
+            flush_size=LOG_FLUSH_SIZE,
+            db_batch_size=LOG_DB_BATCH_SIZE,
+    ):
+        if policy not in ("drop", "block"):
+            raise ValueError(f"Unknown log queue policy '{policy}', use 'drop' or 'block'")
+
+        self.log_file = log_file
+        self.policy = policy
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.db_batch_size = db_batch_size
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._closing = False
+        self._atexit_registered = False
+        self._pid = None
+        self._lock = threading.Lock()
+        self._file = None
+        self._file_pending = 0
+        self._db_rows = []
+        self._last_flush = time.monotonic()
+
+    def configure(
+            self,
+            queue_size: int = None,
+            policy: str = None,
+            flush_interval: float = None,
+            flush_size: int = None,
+            db_batch_size: int = None,
+    ):
+        """
+        Change the writer's settings. Queued lines are written out first,
+        the writer starts again with the new settings on the next log call.
+        """
+        if policy is not None and policy not in ("drop", "block"):
+            raise ValueError(f"Unknown log queue policy '{policy}', use 'drop' or 'block'")
+
+        self.close()
+        if queue_size is not None:
+            self._queue = queue.Queue(maxsize=queue_size)
+        if policy is not None:
+            self.policy = policy
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        if flush_size is not None:
+            self.flush_size = flush_size
+        if db_batch_size is not None:
+            self.db_batch_size = db_batch_size
+
+    def submit(self, record: LogRecord):
+        self._ensure_started()
+
+        if self.policy == "block":
+            self._queue.put(record)
             return
 
-        if timestamp is None:
-            timestamp = datetime.datetime.now()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        with self._lock:
+            thread = self._thread
+            if thread is None or self._pid != os.getpid():
+                return
+            closing, self._closing = self._closing, True
+        if closing:
+            # Another thread is stopping the writer already.
+            thread.join()
+            return
 
-        message = str(message)
-        if len(message) > self.max_length:
-            message = (
-                    message[0: int(self.max_length / 2)]
-                    + " { ... ... ... truncated ... ... ... } "
-                    + message[int(-1 * (self.max_length / 2)):]
-            )
+        # The thread stays set until it has stopped, so log calls made
+        # meanwhile queue their lines instead of starting a second writer.
+        self._queue.put(self._stop)
+        thread.join()
 
-        stack_info = inspect.stack()[1][3]
+        # Lines queued behind the stop sentinel, at most as many as are
+        # there now so that a busy process cannot keep close() going.
+        for _ in range(self._queue.qsize()):
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not self._stop:
+                self._write(record)
+        self._flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        with self._lock:
+            self._thread = None
+            self._closing = False
+            restart = not self._queue.empty()
+        if restart:
+            # Lines logged while closing, or callers blocked on a full queue, need a writer.
+            self._ensure_started()
+
+    def after_fork(self):
+        """
+        Forget the parent's queue, lock, thread and logfile handle in a
+        forked child. The parent may have held the queue's lock at fork
+        time, so the child must not touch it. Flush the parent (close())
+        before forking or its buffered lines are written twice.
+        """
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closing = False
+        self._pid = None
+        self._file = None
+        self._file_pending = 0
+        self._db_rows = []
+        self._last_flush = time.monotonic()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
 
-        formatted_message = (
-                ColorTypes.INFOBLUE
-                + f"[{str(timestamp)}]"
-                + " "
-                + f"[{g.get('email', '- not logged in -')}]"
-                + " "
-                + f"[{stack_info}]"
-                + " "
-                + str(message)
-                + ColorTypes.ENDC
-        )
+        with self._lock:
+            # Threads do not survive a fork, a forked worker starts its own writer.
+            if self._thread is None or self._pid != os.getpid():
+                self._file = None
+                self._file_pending = 0
+                self._db_rows = []
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+                if not self._atexit_registered:
+                    atexit.register(self.close)
+                    self._atexit_registered = True
+
+    def _run(self):
+        while True:
+            timeout = max(self.flush_interval - (time.monotonic() - self._last_flush), 0)
+            try:
+                record = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._flush()
+                continue
+
+            if record is self._stop:
+                return
+
+            self._write(record)
+
+            if (
+                    self._file_pending >= self.flush_size
+                    or len(self._db_rows) >= self.db_batch_size
+                    or time.monotonic() - self._last_flush >= self.flush_interval
+            ):
+                self._flush()
+
+    def _write(self, record: LogRecord):
+        try:
+            if record.to_screen:
+                print(record.formatted, **record.kwargs)
+
+            if record.to_file:
+                line = record.text + "\n"
+                if self._file is None:
+                    self._file = open(self.log_file, "a", buffering=self.flush_size)
+                self._file.write(line)
+                self._file_pending += len(line)
+
+            if record.to_database:
+                self._db_rows.append(record.database_row())
+        except Exception as e:
+            print(f"Could not write log line: {str(e)}", file=sys.stderr)
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+
+        if self._file is not None and self._file_pending:
+            try:
+                self._file.flush()
+            except Exception as e:
+                print(f"Could not flush logfile: {str(e)}", file=sys.stderr)
+            self._file_pending = 0
 
-        self.do_logging(
-            formatted_message=formatted_message,
-            timestamp=timestamp,
-            log_level="INFO",
-            stack_info=stack_info,
-            message=message,
-            user=g.get("email", "- not logged in -"),
-            **kwargs,
-        )
+        if self._db_rows:
+            rows, self._db_rows = self._db_rows, []
+            try:
+                from database import db_session_manager
+                from models.log import Log
 
-    def ok(self, message: str, timestamp: datetime.datetime = None, **kwargs):
+                with db_session_manager() as session:
+                    session.bulk_insert_mappings(Log, rows)
+                    session.commit()
+            except Exception as e:
+                print(f"Could not write {len(rows)} log line(s) to database: {str(e)}", file=sys.stderr)
 
-        if log_level_definitions[self.log_level] < 4:
-            return
 
-        message = str(message)
-        if len(message) > self.max_length:
-            message = (
-                    message[0: int(self.max_length / 2)]
-                    + " { ... ... ... truncated ... ... ... } "
-                    + message[int(-1 * (self.max_length / 2)):]
-            )
+class LogLimiter(object):
+    """
+    Decides, on the calling thread, whether a log call is written:
 
-        if timestamp is None:
-            timestamp = datetime.datetime.now()
+    - sampling: a call is written with the probability found in
+      `sample_rates` under "module.function:LEVEL", "module.function"
+      or "LEVEL", in that order, 1 if none matches;
+    - deduplication: a call site that repeats its last message within
+      `deduplicate_window` seconds is counted instead of written. Only
+      str messages are compared, others are not converted to text on
+      the calling thread and are never deduplicated;
+    - rate limiting: at most `rate_limit` lines per second are written
+      from one call site.
 
-        stack_info = inspect.stack()[1][3]
+    Repeats and rate limited lines are summarised in a line of their own
+    when the call site logs again after the window or second, or when
+    pending() is called at shutdown. Sampled out lines are only counted.
 
-        formatted_message = (
-                ColorTypes.OKGREEN
-                + f"[{str(timestamp)}]"
-                + " "
-                + f"[{g.get('email', '- not logged in -')}]"
-                + " "
-                + f"[{stack_info}]"
-                + " "
-                + str(message)
-                + ColorTypes.ENDC
-        )
+    All of it is off by default. Deduplication and rate limiting take a
+    lock shared by all call sites on every log call.
+    """
 
-        self.do_logging(
-            formatted_message=formatted_message,
-            timestamp=timestamp,
-            log_level="OK",
-            stack_info=stack_info,
-            message=message,
-            user=g.get("email", "- not logged in -"),
-            **kwargs,
-        )
+    def __init__(
+            self,
+            sample_rates: dict = None,
+            deduplicate_window: float = LOG_DEDUPLICATE_WINDOW,
+            rate_limit: int = LOG_RATE_LIMIT,
+    ):
+        self.sample_rates = dict(sample_rates if sample_rates is not None else LOG_SAMPLE_RATES)
+        self.deduplicate_window = deduplicate_window
+        self.rate_limit = rate_limit
+        self.sampled_out = 0
+        self.deduplicated = 0
+        self.rate_limited = 0
+        self._site_names = {}
+        self._last_message = {}
+        self._second = {}
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return bool(self.sample_rates) or self.deduplicate_window > 0 or self.rate_limit > 0
+
+    def configure(self, sample_rates: dict = None, deduplicate_window: float = None, rate_limit: int = None):
+        with self._lock:
+            if sample_rates is not None:
+                self.sample_rates = dict(sample_rates)
+            if deduplicate_window is not None:
+                self.deduplicate_window = deduplicate_window
+            if rate_limit is not None:
+                self.rate_limit = rate_limit
+
+    def check(self, frame, level: str, message: any) -> tuple:
+        """
+        :param frame: frame of the function that made the log call
+        :param level: level of the log call
+        :param message: the message as passed to the log call
+        :return: (write, summaries): whether to write the line, and
+            (level, text) summary lines to write before it
+        """
+        site = (frame.f_code, frame.f_lineno)
+
+        if self.sample_rates:
+            rate = self._sample_rate(frame, level)
+            if rate < 1 and random.random() >= rate:
+                self.sampled_out += 1
+                return False, []
+
+        now = time.monotonic()
+        summaries = []
+
+        with self._lock:
+            if self.deduplicate_window > 0 and isinstance(message, str):
+                last = self._last_message.get(site)
+                if last is not None and last[0] == level and last[1] == message and now < last[2]:
+                    last[3] += 1
+                    self.deduplicated += 1
+                    return False, summaries
+                if last is not None and last[3]:
+                    summaries.append(self._repeated_summary(last))
+                self._last_message[site] = [level, message, now + self.deduplicate_window, 0]
+
+            if self.rate_limit > 0:
+                second = int(now)
+                state = self._second.get(site)
+                if state is None or state[0] != second:
+                    if state is not None and state[2]:
+                        summaries.append(self._rate_limited_summary(state))
+                    state = self._second[site] = [second, 0, 0, level]
+                if state[1] >= self.rate_limit:
+                    state[2] += 1
+                    self.rate_limited += 1
+                    return False, summaries
+                state[1] += 1
+
+        return True, summaries
+
+    def pending(self) -> list:
+        """
+        Take the summaries that have not been written yet.
+
+        :return: [(code object of the call site, level, text), ...]
+        """
+        summaries = []
+        with self._lock:
+            for site, last in self._last_message.items():
+                if last[3]:
+                    summaries.append((site[0], last[0], self._repeated_summary(last)[1]))
+                    last[3] = 0
+            for site, state in self._second.items():
+                if state[2]:
+                    summaries.append((site[0], state[3], self._rate_limited_summary(state)[1]))
+                    state[2] = 0
+        return summaries
+
+    def stats(self) -> dict:
+        return {
+            "sampled_out": self.sampled_out,
+            "deduplicated": self.deduplicated,
+            "rate_limited": self.rate_limited,
+        }
+
+    def _sample_rate(self, frame, level: str) -> float:
+        code = frame.f_code
+        name = self._site_names.get(code)
+        if name is None:
+            name = self._site_names[code] = f"{frame.f_globals.get('__name__')}.{code.co_name}"
+        rates = self.sample_rates
+        return rates.get(f"{name}:{level}", rates.get(name, rates.get(level, 1)))
+
+    @staticmethod
+    def _repeated_summary(last: list) -> tuple:
+        return last[0], f"(repeated {last[3]} times) {last[1]}"
+
+    def _rate_limited_summary(self, state: list) -> tuple:
+        return state[3], f"{state[2]} log line(s) suppressed, more than {self.rate_limit} per second"
 
-    def warning(self, message, timestamp: datetime.datetime = None, **kwargs):
-        if log_level_definitions[self.log_level] < 3:
-            return
 
-        message = str(message)
-        if len(message) > self.max_length:
-            message = (
-                    message[0: int(self.max_length / 2)]
-                    + " { ... ... ... truncated ... ... ... } "
-                    + message[int(-1 * (self.max_length / 2)):]
-            )
+class CustomLogger(object, metaclass=Singleton):
+    def __init__(
+            self,
+            log_level=LOG_LEVEL,
+            log_to_screen=LOG_TO_SCREEN,
+            log_to_database=LOG_TO_DATABASE,
+            log_to_file=LOG_TO_FILE,
+            max_length=60000,
+            writer=None,
+            limiter=None,
+    ):
+        self._enabled = {}
+        self.log_level = log_level
+        self.log_to_screen = log_to_screen
+        self.log_to_file = log_to_file
+        self.log_to_database = log_to_database
+        self.max_length = max_length
+        self.writer = writer if writer is not None else LogWriter()
+        self.limiter = limiter if limiter is not None else LogLimiter()
+
+    @property
+    def log_level(self):
+        return self._log_level
+
+    @log_level.setter
+    def log_level(self, log_level):
+        # The per-level checks are computed once here instead of on every call.
+        self._log_level = log_level
+        self._enabled = {
+            level: log_level_definitions[log_level] >= minimum
+            for level, (minimum, _) in level_definitions.items()
+        }
 
-        if timestamp is None:
-            timestamp = datetime.datetime.now()
+    def debug(self, message: any, timestamp: datetime.datetime = None, **kwargs):
+        if self._enabled["DEBUG"]:
+            self._log("DEBUG", message, timestamp, kwargs)
 
-        stack_info = inspect.stack()[1][3]
+    def header(self, message: str, timestamp: datetime.datetime = None, **kwargs):
+        if self._enabled["HEADER"]:
+            self._log("HEADER", message, timestamp, kwargs)
 
-        formatted_message = (
-                ColorTypes.WARNING
-                + f"[{str(timestamp)}]"
-                + " "
-                + f"[{g.get('email', '- not logged in -')}]"
-                + " "
-                + f"[{stack_info}]"
-                + " "
-                + str(message)
-                + ColorTypes.ENDC
-        )
+    def info(
+            self,
+            message: str,
+            timestamp: datetime.datetime = None,
+            **kwargs: object,
+    ) -> object:
+        if self._enabled["INFO"]:
+            self._log("INFO", message, timestamp, kwargs)
 
-        self.do_logging(
-            formatted_message=formatted_message,
-            timestamp=timestamp,
-            log_level="WARNING",
-            stack_info=stack_info,
-            message=message,
-            user=g.get("email", "- not logged in -"),
-            **kwargs,
-        )
+    def ok(self, message: str, timestamp: datetime.datetime = None, **kwargs):
+        if self._enabled["OK"]:
+            self._log("OK", message, timestamp, kwargs)
+
+    def warning(self, message, timestamp: datetime.datetime = None, **kwargs):
+        if self._enabled["WARNING"]:
+            self._log("WARNING", message, timestamp, kwargs)
 
     def fail(
             self,
@@ -280,88 +591,109 @@ class CustomLogger(object, metaclass=Singleton):
             stop=False,
             **kwargs,
     ):
-        if log_level_definitions[self.log_level] < 2:
-            return
+        if self._enabled["FAIL"]:
+            self._log("FAIL", message, timestamp, kwargs)
 
-        message = str(message)
-        if len(message) > self.max_length:
-            message = (
-                    message[0: int(self.max_length / 2)]
-                    + " { ... ... ... truncated ... ... ... } "
-                    + message[int(-1 * (self.max_length / 2)):]
-            )
+    def _log(self, level: str, message: any, timestamp: datetime.datetime, kwargs: dict):
+        to_screen = self.log_to_screen
+        to_database = self.log_to_database
 
-        if timestamp is None:
-            timestamp = datetime.datetime.now()
+        if not (to_screen or to_database or self.log_to_file):
+            return
 
-        stack_info = inspect.stack()[1][3]
+        # Only the screen and database sinks show the caller and the user.
+        needs_caller = to_screen or to_database
+        frame = sys._getframe(2)
 
-        formatted_message = (
-                ColorTypes.FAIL
-                + f"[{str(timestamp)}]"
-                + " "
-                + f"[{g.get('email', '- not logged in -')}]"
-                + " "
-                + f"[{stack_info}]"
-                + " "
-                + str(message)
-                + ColorTypes.ENDC
+        if self.limiter.active:
+            write, summaries = self.limiter.check(frame, level, message)
+            for summary_level, summary in summaries:
+                self._log_summary(frame.f_code, summary_level, summary)
+            if not write:
+                return
+
+        self.do_logging(
+            LogRecord(
+                level=level,
+                message=message,
+                timestamp=timestamp if timestamp is not None else datetime.datetime.now(),
+                user=self._current_user() if needs_caller else None,
+                code=frame.f_code if needs_caller else None,
+                kwargs=kwargs,
+                max_length=self.max_length,
+                to_screen=to_screen,
+                to_file=self.log_to_file,
+                to_database=to_database,
+            )
         )
 
+    def _log_summary(self, code, level: str, message: str):
         self.do_logging(
-            formatted_message=formatted_message,
-            timestamp=timestamp,
-            log_level="FAIL",
-            stack_info=stack_info,
-            message=message,
-            user=g.get("email", "- not logged in -"),
-            **kwargs,
+            LogRecord(
+                level=level,
+                message=message,
+                timestamp=datetime.datetime.now(),
+                code=code,
+                max_length=self.max_length,
+                to_screen=self.log_to_screen,
+                to_file=self.log_to_file,
+                to_database=self.log_to_database,
+            )
         )
 
+    @staticmethod
+    def _current_user() -> str:
+        # Read g straight from the context stack, the flask.g proxy costs more than the rest of the call.
+        app_context = _app_ctx_stack.top
+        if app_context is None:
+            return "- not logged in -"
+        return app_context.g.get("email", "- not logged in -")
+
     def write_to_database(self, timestamp, level, function, message, user):
 
         if not self.log_to_database:
             return
 
-        from db.base import db_session_manager
-        from db.models.log import Log
-
-        with db_session_manager() as session:
-            log_line = Log()
-            log_line.timestamp = timestamp
-            log_line.level = str(level)
-            log_line.function = str(function)
-            log_line.message = str(message)
-            log_line.user = str(user)
-            session.add(log_line)
-            session.commit()
+        self.do_logging(
+            LogRecord(
+                level=level,
+                message=message,
+                timestamp=timestamp,
+                user=user,
+                function=function,
+                max_length=self.max_length,
+                to_database=True,
+            )
+        )
 
     def write_to_logfile(self, message: str = None):
-        from init_app import app
 
         if message:
-            try:
-                f = open(app.config.get("LOGFILE", "./ticketmatrix.log"), "a")
-                f.write(message + "\n")
-            except Exception as e:
-                self.fail(f"Could not write to logfile: {str(e)}", stop=True)
-
-    def do_logging(
-            self,
-            formatted_message,
-            timestamp,
-            log_level,
-            stack_info,
-            message,
-            user,
-            **kwargs,
-    ):
-
-        if self.log_to_screen:
-            print(formatted_message, **kwargs)
-
-        if self.log_to_file:
-            self.write_to_logfile(message=message)
+            self.do_logging(
+                LogRecord(
+                    level="INFO",
+                    message=message,
+                    timestamp=datetime.datetime.now(),
+                    max_length=self.max_length,
+                    to_file=True,
+                )
+            )
 
-        if self.log_to_database:
-            self.write_to_database(timestamp, log_level, stack_info, message, user=user)
+    def shutdown(self):
+        """
+        Write the pending repeat and rate limit summaries, flush every
+        queued log line and stop the background writer. The writer starts
+        again on the next log call.
+        """
+        for code, level, message in self.limiter.pending():
+            self._log_summary(code, level, message)
+        self.writer.close()
+
+    def after_fork(self):
+        """
+        Reset the background writer in a forked worker, see LogWriter.after_fork.
+        """
+        self.writer.after_fork()
+
+    def do_logging(self, record: LogRecord):
+        self.writer.submit(record)
@@ -0,0 +1,61 @@
+"""initial schema
+
+Revision ID: 3f1c2a9d7b10
+Revises:
+Create Date: 2026-10-18 07:30:00.000000
+
+The account and token tables as the models declared them before
+migrations were added. Databases that were created with create_all
+back then already have this schema, mark them with
+`flask db stamp 3f1c2a9d7b10` before running `flask db upgrade`.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'account',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('uid', sa.Text(), nullable=True),
+        sa.Column('code', sa.Text(), nullable=False),
+        sa.Column('login_code', sa.Text(), nullable=False),
+        sa.Column('login_secret', sa.LargeBinary(), nullable=False),
+        sa.Column('admin_level', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_account_code'), 'account', ['code'], unique=False)
+    op.create_index(op.f('ix_account_login_code'), 'account', ['login_code'], unique=True)
+    op.create_index(op.f('ix_account_login_secret'), 'account', ['login_secret'], unique=False)
+    op.create_index(op.f('ix_account_uid'), 'account', ['uid'], unique=False)
+    op.create_table(
+        'token',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('uid', sa.Text(), nullable=True),
+        sa.Column('key', sa.Text(), nullable=True),
+        sa.Column('valid_until', sa.DateTime(), nullable=True),
+        sa.Column('account_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['account_id'], ['account.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_token_key'), 'token', ['key'], unique=False)
+    op.create_index(op.f('ix_token_uid'), 'token', ['uid'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_token_uid'), table_name='token')
+    op.drop_index(op.f('ix_token_key'), table_name='token')
+    op.drop_table('token')
+    op.drop_index(op.f('ix_account_uid'), table_name='account')
+    op.drop_index(op.f('ix_account_login_secret'), table_name='account')
+    op.drop_index(op.f('ix_account_login_code'), table_name='account')
+    op.drop_index(op.f('ix_account_code'), table_name='account')
+    op.drop_table('account')
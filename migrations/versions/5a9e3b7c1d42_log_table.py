@@ -0,0 +1,37 @@
+"""log table
+
+Revision ID: 5a9e3b7c1d42
+Revises: 3f1c2a9d7b10
+Create Date: 2026-10-18 07:30:10.000000
+
+Rows written by the LogWriter when CustomLogger.log_to_database is on.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a9e3b7c1d42'
+down_revision = '3f1c2a9d7b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'log',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.Column('level', sa.Text(), nullable=True),
+        sa.Column('function', sa.Text(), nullable=True),
+        sa.Column('message', sa.Text(), nullable=True),
+        sa.Column('user', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_log_timestamp'), 'log', ['timestamp'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_log_timestamp'), table_name='log')
+    op.drop_table('log')
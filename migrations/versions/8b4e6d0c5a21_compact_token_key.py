@@ -0,0 +1,90 @@
+"""compact token key
+
+Revision ID: 8b4e6d0c5a21
+Revises: 9d3f6a2b8e17
+Create Date: 2026-10-18 07:31:00.000000
+
+Store token.key as the 32 bytes its hex string encodes, with a unique
+index, and drop the index on account.login_secret. Tokens whose key is
+not 64 hex characters cannot be presented by a client and are deleted.
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4e6d0c5a21'
+down_revision = '9d3f6a2b8e17'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000  # Tokens converted per UPDATE when the database cannot convert them itself.
+HEX_KEY = re.compile(r'^[0-9a-fA-F]{64}$')
+
+token = sa.table(
+    'token',
+    sa.column('id', sa.Integer),
+    sa.column('key', sa.Text),
+    sa.column('key_bytes', sa.LargeBinary),
+    sa.column('key_hex', sa.Text),
+)
+
+
+def copy_in_batches(source, target, convert):
+    """Fill `target` with `convert(source)` for every token, BATCH_SIZE tokens at a time."""
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(token.c.id, token.c[source]).where(
+                token.c.id > last_id
+            ).order_by(token.c.id).limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        values = [{'token_id': token_id, 'value': convert(value)} for token_id, value in rows]
+        values = [row for row in values if row['value'] is not None]
+        if values:
+            bind.execute(
+                token.update().where(token.c.id == sa.bindparam('token_id')).values({target: sa.bindparam('value')}),
+                values
+            )
+
+
+def upgrade():
+    op.add_column('token', sa.Column('key_bytes', sa.LargeBinary(32), nullable=True))
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("UPDATE token SET key_bytes = decode(key, 'hex') WHERE key ~ '^[0-9a-fA-F]{64}$'")
+    else:
+        copy_in_batches('key', 'key_bytes', lambda key: bytes.fromhex(key) if key and HEX_KEY.match(key) else None)
+    op.execute('DELETE FROM token WHERE key_bytes IS NULL')
+
+    with op.batch_alter_table('token') as batch_op:
+        batch_op.drop_index('ix_token_key')
+        batch_op.drop_column('key')
+        batch_op.alter_column('key_bytes', new_column_name='key', nullable=False)
+    op.create_index('ix_token_key', 'token', ['key'], unique=True)
+
+    with op.batch_alter_table('account') as batch_op:
+        batch_op.drop_index('ix_account_login_secret')
+
+
+def downgrade():
+    with op.batch_alter_table('account') as batch_op:
+        batch_op.create_index('ix_account_login_secret', ['login_secret'], unique=False)
+
+    op.add_column('token', sa.Column('key_hex', sa.Text(), nullable=True))
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("UPDATE token SET key_hex = encode(key, 'hex')")
+    else:
+        copy_in_batches('key', 'key_hex', lambda key: bytes(key).hex())
+
+    with op.batch_alter_table('token') as batch_op:
+        batch_op.drop_index('ix_token_key')
+        batch_op.drop_column('key')
+        batch_op.alter_column('key_hex', new_column_name='key')
+    op.create_index('ix_token_key', 'token', ['key'], unique=False)
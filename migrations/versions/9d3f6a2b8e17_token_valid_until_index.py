@@ -0,0 +1,39 @@
+"""token valid_until index
+
+Revision ID: 9d3f6a2b8e17
+Revises: 5a9e3b7c1d42
+Create Date: 2026-10-18 07:30:20.000000
+
+Index on token.valid_until for the token reaper, which deletes expired
+tokens by a valid_until range. On PostgreSQL it is built CONCURRENTLY,
+without blocking writes to a large token table.
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3f6a2b8e17'
+down_revision = '5a9e3b7c1d42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.create_index(
+                op.f('ix_token_valid_until'), 'token', ['valid_until'], unique=False, postgresql_concurrently=True
+            )
+        return
+
+    op.create_index(op.f('ix_token_valid_until'), 'token', ['valid_until'], unique=False)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.drop_index(op.f('ix_token_valid_until'), table_name='token', postgresql_concurrently=True)
+        return
+
+    op.drop_index(op.f('ix_token_valid_until'), table_name='token')
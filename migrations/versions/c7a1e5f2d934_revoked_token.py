@@ -0,0 +1,36 @@
+"""revoked token
+
+Revision ID: c7a1e5f2d934
+Revises: 8b4e6d0c5a21
+Create Date: 2026-10-18 07:45:00.000000
+
+Deny-list of signed tokens that were revoked before they expired.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7a1e5f2d934'
+down_revision = '8b4e6d0c5a21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'revoked_token',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('jti', sa.Text(), nullable=False),
+        sa.Column('valid_until', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_revoked_token_jti'), 'revoked_token', ['jti'], unique=True)
+    op.create_index(op.f('ix_revoked_token_valid_until'), 'revoked_token', ['valid_until'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_revoked_token_valid_until'), table_name='revoked_token')
+    op.drop_index(op.f('ix_revoked_token_jti'), table_name='revoked_token')
+    op.drop_table('revoked_token')
@@ -0,0 +1,67 @@
+"""index layout
+
+Revision ID: d2b8f4a61c07
+Revises: c7a1e5f2d934
+Create Date: 2026-10-18 08:00:00.000000
+
+Indexes for the hot queries:
+
+- account (code, id) for listing the logins of an account code, it
+  replaces the index on code alone;
+- token (account_id, valid_until) for finding the newest valid token of
+  an account at login, token.account_id had no index;
+- token (key) INCLUDE (account_id, valid_until) on PostgreSQL, so
+  validating a key is an index-only lookup.
+
+On PostgreSQL the indexes are built CONCURRENTLY, without blocking
+writes to large tables.
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2b8f4a61c07'
+down_revision = 'c7a1e5f2d934'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.create_index(
+                'ix_account_code_id', 'account', ['code', 'id'], unique=False, postgresql_concurrently=True
+            )
+            op.create_index(
+                'ix_token_account_id_valid_until', 'token', ['account_id', 'valid_until'], unique=False,
+                postgresql_concurrently=True
+            )
+            op.create_index(
+                'ix_token_key_include', 'token', ['key'], unique=True,
+                postgresql_include=['account_id', 'valid_until'], postgresql_concurrently=True
+            )
+            op.drop_index('ix_token_key', table_name='token', postgresql_concurrently=True)
+            op.execute('ALTER INDEX ix_token_key_include RENAME TO ix_token_key')
+            op.drop_index('ix_account_code', table_name='account', postgresql_concurrently=True)
+        return
+
+    op.create_index('ix_account_code_id', 'account', ['code', 'id'], unique=False)
+    op.create_index('ix_token_account_id_valid_until', 'token', ['account_id', 'valid_until'], unique=False)
+    op.drop_index('ix_account_code', table_name='account')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.create_index('ix_account_code', 'account', ['code'], unique=False, postgresql_concurrently=True)
+            op.create_index('ix_token_key_plain', 'token', ['key'], unique=True, postgresql_concurrently=True)
+            op.drop_index('ix_token_key', table_name='token', postgresql_concurrently=True)
+            op.execute('ALTER INDEX ix_token_key_plain RENAME TO ix_token_key')
+            op.drop_index('ix_token_account_id_valid_until', table_name='token', postgresql_concurrently=True)
+            op.drop_index('ix_account_code_id', table_name='account', postgresql_concurrently=True)
+        return
+
+    op.create_index('ix_account_code', 'account', ['code'], unique=False)
+    op.drop_index('ix_token_account_id_valid_until', table_name='token')
+    op.drop_index('ix_account_code_id', table_name='account')
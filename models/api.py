@@ -1,8 +1,9 @@
 import random
 import string
 
-from sqlalchemy import Integer, Column, Text, DateTime, ForeignKey, LargeBinary
+from sqlalchemy import Integer, Column, Text, DateTime, ForeignKey, Index, LargeBinary
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
 
 from database import APIBase
 
@@ -12,24 +13,63 @@ def generate_uid(count=15):
     return uid
 
 
+class HexKey(TypeDecorator):
+    """
+    A hex string in Python, stored as the bytes it encodes. A 64 character
+    API key takes 32 bytes in the column and its index instead of 64+.
+    Binding a string that is not valid hex raises ValueError.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return bytes.fromhex(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return bytes(value).hex()
+
+
 class Account(APIBase):
     __tablename__ = "account"
+    __table_args__ = (
+        # Logins of an account code in id order, for keyset pagination.
+        Index("ix_account_code_id", "code", "id"),
+    )
 
     id = Column(Integer, primary_key=True)
     uid = Column(Text, index=True, default=generate_uid)
-    code = Column(Text, index=True, nullable=False)
+    code = Column(Text, nullable=False)
     login_code = Column(Text, index=True, nullable=False, unique=True)
-    login_secret = Column(LargeBinary, index=True, nullable=False)
+    login_secret = Column(LargeBinary, nullable=False)
     admin_level = Column(Integer, default=0)
 
 
 class Token(APIBase):
     __tablename__ = "token"
+    __table_args__ = (
+        # On PostgreSQL validating a key is answered from the index alone.
+        Index("ix_token_key", "key", unique=True, postgresql_include=["account_id", "valid_until"]),
+        # The newest valid token of an account, at login.
+        Index("ix_token_account_id_valid_until", "account_id", "valid_until"),
+    )
 
     id = Column(Integer, primary_key=True)
     uid = Column(Text, index=True, default=generate_uid)
-    key = Column(Text, index=True)
-    valid_until = Column(DateTime)
+    key = Column(HexKey(32), nullable=False)
+    valid_until = Column(DateTime, index=True)
     account_id = Column(Integer, ForeignKey("account.id"))
 
     account = relationship("Account")
+
+
+class RevokedToken(APIBase):
+    __tablename__ = "revoked_token"
+
+    id = Column(Integer, primary_key=True)
+    jti = Column(Text, index=True, unique=True, nullable=False)
+    valid_until = Column(DateTime, index=True, nullable=False)
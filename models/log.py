@@ -0,0 +1,14 @@
+from sqlalchemy import Integer, Column, Text, DateTime
+
+from database import APIBase
+
+
+class Log(APIBase):
+    __tablename__ = "log"
+
+    id = Column(Integer, primary_key=True)
+    timestamp = Column(DateTime, index=True)
+    level = Column(Text)
+    function = Column(Text)
+    message = Column(Text)
+    user = Column(Text)
@@ -0,0 +1,91 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import event
+
+os.environ["APP_SETTINGS"] = "config.Testing"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+from init_app import create_app  # noqa: E402
+from logger import CustomLogger  # noqa: E402
+from models.api import Account  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def app():
+    log = CustomLogger()
+    log.log_to_screen = False
+    log.log_to_file = False
+    log.log_to_database = False
+
+    return create_app()
+
+
+@pytest.fixture
+def client(app):
+    """A test client on empty tables and empty caches."""
+    from endpoints.auth import token_lifetime
+    from helpers.account_cache import account_cache
+    from helpers.token_cache import token_cache
+
+    engine = database.get_engine()
+    database.APIBase.metadata.drop_all(engine)
+    database.create_all(engine)
+    token_cache.clear()
+    account_cache.clear()
+
+    yield app.test_client()
+
+    token_lifetime.configure(
+        sliding=app.config.get("TOKEN_SLIDING_EXPIRATION"),
+        threshold=app.config.get("TOKEN_EXTEND_THRESHOLD"),
+        buffered=app.config.get("TOKEN_EXTEND_BUFFERED"),
+    )
+
+
+@pytest.fixture
+def rpc(client):
+    """Call "<blueprint>.<method>" with keyword params and return its result."""
+
+    def call(method: str, **params) -> dict:
+        blueprint, name = method.split(".")
+        response = client.post(
+            f"/api/v1/{blueprint}", json={"jsonrpc": "2.0", "method": name, "params": params, "id": 1}
+        )
+        return response.get_json()["result"]
+
+    return call
+
+
+@pytest.fixture
+def add_account(client):
+    """Insert an account with the given login secret."""
+    from helpers.password import password_hasher
+
+    def add(account_code: str, login_code: str, login_secret: str, admin_level: int = 0):
+        with database.db_session_manager() as s:
+            s.add(Account(
+                code=account_code,
+                login_code=login_code,
+                login_secret=password_hasher.hash_password(login_secret.encode()),
+                admin_level=admin_level,
+            ))
+            s.commit()
+
+    return add
+
+
+@pytest.fixture
+def statements(client):
+    """Every SQL statement run while the test runs, in order."""
+    engine = database.get_engine()
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(engine, "before_cursor_execute", record)
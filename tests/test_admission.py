@@ -0,0 +1,49 @@
+import pytest
+
+from helpers.admission import admission
+
+
+@pytest.fixture
+def rate_limited(app):
+    admission.configure(enabled=True, login_rate=0, login_burst=5)
+    yield
+    admission.configure(
+        enabled=app.config.get("ADMISSION_ENABLED"),
+        login_rate=app.config.get("ADMISSION_LOGIN_RATE"),
+        login_burst=app.config.get("ADMISSION_LOGIN_BURST"),
+    )
+
+
+def login(client, params):
+    response = client.post("/api/v1/auth", json={"jsonrpc": "2.0", "method": "login", "params": params, "id": 1})
+    return response.get_json()["result"]["message"]
+
+
+@pytest.mark.parametrize("params", [
+    {"ac": "ACME", "lc": "victim", "ls": "guess"},
+    ["ACME", "victim", "guess"],
+])
+def test_login_code_bucket(client, rate_limited, params):
+    messages = [login(client, params) for _ in range(8)]
+
+    assert messages[:5] == ["No Account Found"] * 5
+    assert messages[5:] == ["too many requests"] * 3
+
+
+def test_positional_and_keyword_params_share_a_bucket(client, rate_limited):
+    messages = [login(client, ["ACME", "victim", "guess"]) for _ in range(3)]
+    messages += [login(client, {"ac": "ACME", "lc": "victim", "ls": "guess"}) for _ in range(3)]
+
+    assert messages.count("too many requests") == 1
+
+
+@pytest.mark.parametrize("params", [
+    {"ac": ["ACME"], "lc": "victim", "ls": "guess"},
+    {"ac": "ACME", "lc": {"code": "victim"}, "ls": "guess"},
+    [["ACME"], "victim", "guess"],
+])
+def test_unhashable_params(client, rate_limited, params):
+    response = client.post("/api/v1/auth", json={"jsonrpc": "2.0", "method": "login", "params": params, "id": 1})
+
+    assert response.get_json()["error"]["name"] == "InvalidParamsError"
+    assert len(admission.account_buckets) == 0
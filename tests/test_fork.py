@@ -0,0 +1,42 @@
+import threading
+
+import pytest
+
+from endpoints.auth import token_lifetime
+from helpers.metrics import registry
+from helpers.token_reaper import token_reaper
+from init_app import after_fork, before_fork
+
+BACKGROUND_THREADS = {"token-reaper", "token-extension-flush", "metrics-writer"}
+
+
+def background_threads() -> set:
+    return {thread.name for thread in threading.enumerate() if thread.is_alive()} & BACKGROUND_THREADS
+
+
+@pytest.fixture
+def preloaded_app(app, tmp_path):
+    metrics_enabled = app.config.get("METRICS_ENABLED")
+    app.config.update(METRICS_ENABLED=True)
+    token_reaper.start(interval=60)
+    token_lifetime.configure(sliding=True, buffered=True)
+    registry.configure(directory=str(tmp_path))
+    yield app
+    token_reaper.stop()
+    token_reaper.interval = app.config.get("TOKEN_REAPER_INTERVAL")
+    token_lifetime.configure(
+        sliding=app.config.get("TOKEN_SLIDING_EXPIRATION"), buffered=app.config.get("TOKEN_EXTEND_BUFFERED")
+    )
+    registry.close()
+    registry.directory = app.config.get("METRICS_DIR")
+    app.config.update(METRICS_ENABLED=metrics_enabled)
+
+
+def test_before_fork_stops_background_threads(client, preloaded_app):
+    assert background_threads() == BACKGROUND_THREADS
+
+    before_fork()
+    assert background_threads() == set()
+
+    after_fork(preloaded_app)
+    assert background_threads() == BACKGROUND_THREADS
@@ -0,0 +1,52 @@
+import sys
+
+from logger import CustomLogger, LogLimiter
+
+
+class Message(object):
+    formatted = 0
+
+    def __str__(self):
+        Message.formatted += 1
+        return "message"
+
+
+def test_off_by_default():
+    assert not LogLimiter().active
+
+
+def test_message_is_not_formatted_on_calling_thread():
+    limiter = LogLimiter(deduplicate_window=60, rate_limit=100)
+    frame = sys._getframe()
+    message = Message()
+
+    assert [limiter.check(frame, "DEBUG", message)[0] for _ in range(3)] == [True] * 3
+    assert Message.formatted == 0
+    assert limiter.deduplicated == 0
+
+
+def test_str_messages_are_deduplicated():
+    limiter = LogLimiter(deduplicate_window=60)
+    frame = sys._getframe()
+
+    assert [limiter.check(frame, "DEBUG", "same")[0] for _ in range(3)] == [True, False, False]
+    assert limiter.pending() == [(frame.f_code, "DEBUG", "(repeated 2 times) same")]
+
+
+def test_logger_keeps_message_object(app):
+    log = CustomLogger()
+    records = []
+    limiter = log.limiter
+    log.limiter = LogLimiter(deduplicate_window=60, rate_limit=100)
+    log.do_logging = records.append
+    log.log_to_file = True
+    try:
+        message = Message()
+        log.warning(message)
+    finally:
+        log.limiter = limiter
+        log.log_to_file = False
+        del log.do_logging
+
+    assert records[0]._message is message
+    assert Message.formatted == 0
@@ -0,0 +1,53 @@
+import threading
+from datetime import datetime
+
+from logger import LogRecord, LogWriter
+
+
+def record(message: str) -> LogRecord:
+    return LogRecord("INFO", message, datetime.now(), function="test", to_file=True)
+
+
+def test_close_while_logging(tmp_path):
+    log_file = tmp_path / "log.txt"
+    writer = LogWriter(log_file=str(log_file), policy="block", queue_size=100)
+    stop = threading.Event()
+    written = [0] * 4
+
+    def log(n: int):
+        while not stop.is_set():
+            writer.submit(record(f"thread {n} line {written[n]}"))
+            written[n] += 1
+
+    threads = [threading.Thread(target=log, args=(n,), daemon=True) for n in range(4)]
+    for thread in threads:
+        thread.start()
+
+    for _ in range(20):
+        closer = threading.Thread(target=writer.close, daemon=True)
+        closer.start()
+        closer.join(timeout=10)
+        assert not closer.is_alive(), "close() did not return"
+
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=10)
+    writer.close()
+
+    assert writer._thread is None
+    assert len(log_file.read_text().splitlines()) == sum(written)
+
+
+def test_close_from_two_threads(tmp_path):
+    writer = LogWriter(log_file=str(tmp_path / "log.txt"))
+    writer.submit(record("line"))
+
+    closers = [threading.Thread(target=writer.close, daemon=True) for _ in range(2)]
+    for closer in closers:
+        closer.start()
+    for closer in closers:
+        closer.join(timeout=10)
+        assert not closer.is_alive(), "close() did not return"
+
+    assert writer._thread is None
+    assert (tmp_path / "log.txt").read_text().count("line") == 1
@@ -0,0 +1,67 @@
+from endpoints.auth import token_lifetime
+
+
+def statement_kinds(statements: list) -> list:
+    return [statement.split()[0] for statement in statements]
+
+
+def test_first_login_selects_and_inserts(rpc, add_account, statements):
+    add_account("ACME", "alice", "secret")
+    statements.clear()
+
+    result = rpc("auth.login", ac="ACME", lc="alice", ls="secret")
+
+    assert result["code"] == "ok"
+    assert statement_kinds(statements) == ["SELECT", "INSERT"]
+
+
+def test_repeat_login_extends_token(rpc, add_account, statements):
+    add_account("ACME", "alice", "secret")
+    key = rpc("auth.login", ac="ACME", lc="alice", ls="secret")["api_key"]
+    statements.clear()
+
+    result = rpc("auth.login", ac="ACME", lc="alice", ls="secret")
+
+    assert result["api_key"] == key
+    assert statement_kinds(statements) == ["SELECT", "UPDATE"]
+
+
+def test_repeat_login_sliding_skips_write(rpc, add_account, statements):
+    token_lifetime.configure(sliding=True, threshold=3600, buffered=False)
+    add_account("ACME", "alice", "secret")
+    key = rpc("auth.login", ac="ACME", lc="alice", ls="secret")["api_key"]
+    statements.clear()
+
+    result = rpc("auth.login", ac="ACME", lc="alice", ls="secret")
+
+    assert result["api_key"] == key
+    assert statement_kinds(statements) == ["SELECT"]
+
+
+def test_repeat_login_buffered_defers_write(rpc, add_account, statements):
+    token_lifetime.configure(sliding=True, threshold=0, buffered=True)
+    add_account("ACME", "alice", "secret")
+    key = rpc("auth.login", ac="ACME", lc="alice", ls="secret")["api_key"]
+    statements.clear()
+
+    result = rpc("auth.login", ac="ACME", lc="alice", ls="secret")
+
+    assert result["api_key"] == key
+    assert statement_kinds(statements) == ["SELECT"]
+
+
+def test_unknown_login_selects_once(rpc, statements):
+    result = rpc("auth.login", ac="ACME", lc="nobody", ls="secret")
+
+    assert result["message"] == "No Account Found"
+    assert statement_kinds(statements) == ["SELECT"]
+
+
+def test_wrong_secret_writes_nothing(rpc, add_account, statements):
+    add_account("ACME", "alice", "secret")
+    statements.clear()
+
+    result = rpc("auth.login", ac="ACME", lc="alice", ls="wrong")
+
+    assert result["message"] == "invalid credentials"
+    assert statement_kinds(statements) == ["SELECT"]
@@ -0,0 +1,36 @@
+import bcrypt
+
+from endpoints.account import ACCOUNT_BULK_MAX_ITEMS
+from helpers.password import PasswordHasher
+
+
+def test_bulk_jobs_in_flight():
+    hasher = PasswordHasher(workers=2, queue_size=32, bulk_jobs=1)
+    submit = hasher._submit
+    depths = []
+
+    def record(fn, *args):
+        depths.append(hasher.stats()["queue_depth"])
+        return submit(fn, *args)
+
+    hasher._submit = record
+    try:
+        hashed = hasher.hash_passwords([b"one", b"two", b"three"])
+    finally:
+        hasher.shutdown()
+
+    assert max(depths) == 0
+    assert [bcrypt.checkpw(password, h) for password, h in zip([b"one", b"two", b"three"], hashed)] == [True] * 3
+
+
+def test_create_accounts_item_cap(rpc, add_account):
+    add_account("ACME", "admin", "secret", admin_level=5)
+    key = rpc("auth.login", ac="ACME", lc="admin", ls="secret")["api_key"]
+
+    result = rpc(
+        "account.create_accounts", account_code="ACME", key=key,
+        accounts=[{"login_code": f"bulk-{i}", "login_secret": "secret"} for i in range(ACCOUNT_BULK_MAX_ITEMS + 1)],
+    )
+
+    assert result["code"] == "error"
+    assert result["message"] == "too many accounts"
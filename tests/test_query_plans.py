@@ -0,0 +1,128 @@
+"""
+Every statement the auth and account endpoints run must be answered
+from an index. The statements are recorded while the endpoints run and
+explained afterwards: EXPLAIN QUERY PLAN on SQLite (config.Testing),
+EXPLAIN with sequential scans disabled on PostgreSQL, where the planner
+would otherwise scan the small test tables anyway.
+"""
+import re
+
+import pytest
+from sqlalchemy import event
+
+import database
+from helpers.account_cache import account_cache
+from helpers.signed_token import signed_tokens
+from helpers.token_cache import token_cache
+from helpers.token_reaper import reap_expired_tokens
+
+SQLITE_FULL_SCAN = re.compile(r"^SCAN (?!CONSTANT ROW)")  # "SCAN t" and "SCAN t USING INDEX" read every row.
+
+
+@pytest.fixture
+def recorded(client):
+    """{statement: parameters of its first run} of the statements run during the test."""
+    engine = database.get_engine()
+    statements = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.setdefault(statement, parameters[0] if executemany else parameters)
+
+    event.listen(engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(engine, "before_cursor_execute", record)
+
+
+@pytest.fixture
+def api_key(rpc, add_account):
+    add_account("ACME", "admin", "secret", admin_level=5)
+    return rpc("auth.login", ac="ACME", lc="admin", ls="secret")["api_key"]
+
+
+def explain(connection, statement: str, parameters) -> tuple:
+    """
+    :return: (plan lines, True if the plan contains a full scan)
+    """
+    # The DBAPI cursor takes the recorded parameters as they are, bytes included.
+    cursor = connection.connection.cursor()
+    try:
+        if connection.dialect.name == "sqlite":
+            cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            lines = [row[-1] for row in cursor.fetchall()]
+            return lines, any(SQLITE_FULL_SCAN.match(line) for line in lines)
+
+        if connection.dialect.name == "postgresql":
+            cursor.execute("SET enable_seqscan = off")
+            cursor.execute(f"EXPLAIN {statement}", parameters)
+            lines = [row[0] for row in cursor.fetchall()]
+            return lines, any("Seq Scan" in line for line in lines)
+    finally:
+        cursor.close()
+
+    pytest.skip(f"No query plan check for {connection.dialect.name}")
+
+
+def assert_indexed(statements: dict):
+    full_scans = []
+    with database.get_engine().connect() as connection:
+        for statement, parameters in statements.items():
+            if statement.lstrip().upper().startswith(("INSERT", "SET", "PRAGMA")):
+                continue
+            lines, full_scan = explain(connection, statement, parameters)
+            if full_scan:
+                full_scans.append(" ".join(statement.split()) + "\n    " + "\n    ".join(lines))
+
+    assert statements
+    assert not full_scans, "Full scans:\n" + "\n".join(full_scans)
+
+
+def test_login(rpc, add_account, recorded):
+    add_account("ACME", "alice", "secret")
+
+    rpc("auth.login", ac="ACME", lc="alice", ls="secret")
+    rpc("auth.login", ac="ACME", lc="alice", ls="secret")
+    account_cache.clear()
+    rpc("auth.login", ac="ACME", lc="alice", ls="secret")
+    rpc("auth.login", ac="ACME", lc="nobody", ls="secret")
+
+    assert_indexed(recorded)
+
+
+def test_account_methods(rpc, api_key, recorded):
+    token_cache.clear()
+    rpc(
+        "account.create_account", account_code="ACME", key=api_key,
+        login_code="bob", login_secret_1="secret", login_secret_2="secret",
+    )
+    rpc(
+        "account.create_accounts", account_code="ACME", key=api_key,
+        accounts=[{"login_code": f"bulk-{i}", "login_secret": "secret"} for i in range(3)]
+        + [{"login_code": "bob", "login_secret": "secret"}],
+    )
+    token_cache.clear()
+    page = rpc("account.get_logins_for_account", account_code="ACME", key=api_key, limit=2)
+    rpc("account.get_logins_for_account", account_code="ACME", key=api_key, limit=2, after=page["next"])
+    rpc("account.get_logins_for_account", account_code="ACME", key=api_key, lc="bob", fields=["uid"])
+    rpc("auth.logout", ac="ACME", key=api_key)
+
+    assert_indexed(recorded)
+
+
+def test_signed_tokens(app, rpc, add_account, recorded):
+    signed_tokens.configure(enabled=True, secret_keys=["test-signing-key"])
+    try:
+        add_account("ACME", "alice", "secret")
+        key = rpc("auth.login", ac="ACME", lc="alice", ls="secret")["api_key"]
+        rpc("account.get_logins_for_account", account_code="ACME", key=key, limit=1)
+        rpc("auth.logout", ac="ACME", key=key)
+    finally:
+        signed_tokens.configure(enabled=False)
+
+    assert_indexed(recorded)
+
+
+def test_token_reaper(app, api_key, recorded):
+    with app.app_context():
+        reap_expired_tokens()
+
+    assert_indexed(recorded)
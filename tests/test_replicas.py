@@ -0,0 +1,41 @@
+import pytest
+from sqlalchemy import create_engine
+
+import database
+
+
+@pytest.fixture
+def lagging_replica(client, tmp_path):
+    """A read replica with the schema but none of the primary's rows."""
+    url = f"sqlite:///{tmp_path / 'replica.db'}"
+    database.create_all(create_engine(url))
+    settings = dict(database._engine_settings)
+    database._engine_settings["replica_urls"] = [url]
+    database._replicas = None
+    yield
+    database.dispose_engine()
+    database._engine_settings.update(settings)
+    database._replicas = None
+
+
+def test_fresh_token_is_found_on_the_primary(rpc, add_account, lagging_replica):
+    add_account("ACME", "alice", "secret", admin_level=5)
+    key = rpc("auth.login", ac="ACME", lc="alice", ls="secret")["api_key"]
+
+    logins = rpc("account.get_logins_for_account", account_code="ACME", key=key)
+    created = rpc(
+        "account.create_account", account_code="ACME", key=key,
+        login_code="bob", login_secret_1="secret", login_secret_2="secret",
+    )
+
+    assert logins["code"] == "ok"
+    assert created["code"] == "ok"
+
+
+def test_unknown_token_is_still_rejected(rpc, add_account, lagging_replica):
+    add_account("ACME", "alice", "secret")
+    rpc("auth.login", ac="ACME", lc="alice", ls="secret")
+
+    result = rpc("account.get_logins_for_account", account_code="ACME", key="0" * 64)
+
+    assert result == {"code": "error", "message": "token validation failed"}
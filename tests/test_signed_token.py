@@ -0,0 +1,38 @@
+import pytest
+
+from helpers.signed_token import signed_tokens
+
+
+@pytest.fixture
+def signed_key(app, rpc, add_account):
+    signed_tokens.configure(enabled=True, secret_keys=["test-signing-key"])
+    add_account("ACME", "alice", "secret")
+    yield rpc("auth.login", ac="ACME", lc="alice", ls="secret")["api_key"]
+    signed_tokens.configure(enabled=False, refresh_interval=app.config.get("TOKEN_DENYLIST_REFRESH_INTERVAL"))
+    signed_tokens.refresh()
+
+
+def test_signed_key_is_accepted(rpc, signed_key):
+    assert signed_tokens.is_signed(signed_key)
+    assert rpc("account.get_logins_for_account", account_code="ACME", key=signed_key)["code"] == "ok"
+
+
+def test_logout_twice(rpc, signed_key):
+    assert rpc("auth.logout", ac="ACME", key=signed_key) == {"code": "ok", "message": "logged out"}
+    assert rpc("auth.logout", ac="ACME", key=signed_key) == {"code": "ok", "message": "logged out"}
+
+    assert rpc("account.get_logins_for_account", account_code="ACME", key=signed_key)["code"] == "error"
+
+
+def test_logout_twice_in_other_process(rpc, signed_key, statements):
+    # Another process revoked the key, this one has not reloaded its deny-list yet.
+    assert rpc("auth.logout", ac="ACME", key=signed_key)["code"] == "ok"
+    signed_tokens.configure(refresh_interval=60)
+    signed_tokens._denied = frozenset()
+
+    assert rpc("auth.logout", ac="ACME", key=signed_key) == {"code": "ok", "message": "logged out"}
+    assert any(statement.startswith("INSERT INTO revoked_token") for statement in statements)
+
+
+def test_logout_with_key_of_other_account(rpc, signed_key):
+    assert rpc("auth.logout", ac="OTHER", key=signed_key) == {"code": "error", "message": "invalid token"}
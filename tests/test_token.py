@@ -0,0 +1,45 @@
+import pytest
+
+
+@pytest.fixture
+def api_key(rpc, add_account):
+    add_account("ACME", "alice", "secret", admin_level=5)
+    return rpc("auth.login", ac="ACME", lc="alice", ls="secret")["api_key"]
+
+
+@pytest.mark.parametrize("key", ["zz", "", "a" * 63, "A" * 64, "g" * 64])
+def test_malformed_key_is_rejected_without_a_query(rpc, api_key, statements, key):
+    statements.clear()
+
+    logins = rpc("account.get_logins_for_account", account_code="ACME", key=key)
+    logout = rpc("auth.logout", ac="ACME", key=key)
+
+    assert logins == {"code": "error", "message": "token validation failed"}
+    assert logout == {"code": "error", "message": "invalid token"}
+    assert statements == []
+
+
+def test_valid_key_is_accepted(rpc, api_key):
+    result = rpc("account.get_logins_for_account", account_code="ACME", key=api_key)
+
+    assert result["code"] == "ok"
+    assert [login["login_code"] for login in result["logins"]] == ["alice"]
+
+
+def test_logout_revokes_key(rpc, api_key):
+    assert rpc("auth.logout", ac="ACME", key=api_key) == {"code": "ok", "message": "logged out"}
+
+    assert rpc("auth.logout", ac="ACME", key=api_key) == {"code": "error", "message": "invalid token"}
+    assert rpc("account.get_logins_for_account", account_code="ACME", key=api_key)["code"] == "error"
+
+
+def test_create_account_with_malformed_key(rpc, api_key, statements):
+    statements.clear()
+
+    result = rpc(
+        "account.create_account", account_code="ACME", key="zz",
+        login_code="bob", login_secret_1="secret", login_secret_2="secret",
+    )
+
+    assert result == {"code": "error", "message": "no account for token", "error": "token not present"}
+    assert statements == []